@@ -20,6 +20,49 @@ from world import cprint
 from time import time
 import networkx as nx
 
+
+def read_interaction_file(file):
+    """
+    Parse a whole "uid item item ..." file at once.\n
+    return: users, items (one entry per interaction) and the users that own a non-empty line, all in file order.
+    """
+    with open(file, 'rb') as f:
+        raw = f.read()
+    tokens = np.fromstring(raw, dtype=np.int64, sep=' ')
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    is_sep = buf <= ord(' ')
+    token_start = ~is_sep
+    token_start[1:] &= is_sep[:-1]
+    token_line = np.cumsum(buf == ord('\n'))[token_start]
+    assert len(token_line) == len(tokens), f'{file} contains non integer tokens'
+
+    is_uid = np.ones(len(tokens), dtype=bool)
+    is_uid[1:] = token_line[1:] != token_line[:-1]
+    line_uid = tokens[is_uid]
+    token_owner = np.cumsum(is_uid)[~is_uid] - 1
+    users = line_uid[token_owner]
+    items = tokens[~is_uid]
+    unique_users = line_uid[np.bincount(token_owner, minlength=len(line_uid)) > 0]
+    return users, items, unique_users
+
+def group_by(keys, values):
+    """
+    return:
+        dict: {key: array of values}, keys in order of first appearance, values keep their order (stable sort)
+    """
+    order = np.argsort(keys, kind='stable')
+    uniq, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    groups = np.split(values[order], np.cumsum(counts)[:-1])
+    return {uniq[g].item(): groups[g] for g in np.argsort(first)}
+
+def _first_seen(keys, degree):
+    """
+    return: keys in order of first appearance and their degree, as lists
+    """
+    _, first = np.unique(keys, return_index=True)
+    seen = keys[np.sort(first)]
+    return seen.tolist(), degree[seen].tolist()
+
 class dataset(Dataset):
     """
     Dataset type for pytorch \n
@@ -41,100 +84,42 @@ class dataset(Dataset):
             valid_file = path + '/valid.txt'
             test_file = path + '/test.txt'
         self.path = path
-        trainUniqueUsers, trainItem, trainUser = [], [], []
-        testUniqueUsers, testItem, testUser = [], [], []
-        validUniqueUsers, validItem, validUser = [], [], []
-        self.traindataSize = 0
-        self.testDataSize = 0
         self.validDataSize = 0
 
-        self._TrainPop_item = {}#item's popularity (degree) in the training dataset
-        self._TrainPop_user = {}#user's popularity (degree) in the training dataset
-        
-        self._allPos = {}
-        self._allPos_item = {}
-
-        with open(train_file) as f:
-            for l in f.readlines():
-                if len(l) > 0:
-                    l = l.strip('\n').split(' ')
-                    items = [int(i) for i in l[1:]]
-                    uid = int(l[0])
-                    trainUniqueUsers.append(uid)
-                    trainUser.extend([uid] * len(items))
-                    trainItem.extend(items)
-                    self.m_item = max(self.m_item, max(items))
-                    self.n_user = max(self.n_user, uid)
-                    self.traindataSize += len(items)
-                    #================Pop=================#
-                    for item in items:
-                        if item in self._TrainPop_item.keys():
-                            self._TrainPop_item[item] += 1
-                        else:
-                            self._TrainPop_item[item] = 1
-                        
-                        if item in self._allPos_item.keys():
-                            self._allPos_item[item].append(uid)
-                        else:
-                            self._allPos_item[item] = [uid]
-
-                    if uid in self._TrainPop_user.keys():
-                        self._TrainPop_user[uid] += len(items)
-                    else:
-                        self._TrainPop_user[uid] = len(items)
-
-                    self._allPos[uid] = items
-                    #================Pop=================#
-        self.trainUniqueUsers = np.array(trainUniqueUsers)
-        self.trainUser = np.array(trainUser)
-        self.trainItem = np.array(trainItem)
-
-        with open(test_file) as f:
-            for l in f.readlines():
-                if len(l) > 0:
-                    l = l.strip('\n').split(' ')
-                    if l[1]:
-                        items = [int(i) for i in l[1:]]
-                        uid = int(l[0])
-                        testUniqueUsers.append(uid)
-                        testUser.extend([uid] * len(items))
-                        testItem.extend(items)
-                        self.m_item = max(self.m_item, max(items))
-                        self.n_user = max(self.n_user, uid)
-                        self.testDataSize += len(items)
-        self.testUniqueUsers = np.array(testUniqueUsers)
-        self.testUser = np.array(testUser)
-        self.testItem = np.array(testItem)
-        
-        
+        #================Pop=================#
+        self.trainUser, self.trainItem, self.trainUniqueUsers = read_interaction_file(train_file)
+        self.traindataSize = len(self.trainItem)
+        self.m_item = max(self.m_item, int(self.trainItem.max()))
+        self.n_user = max(self.n_user, int(self.trainUser.max()))
+
+        self.testUser, self.testItem, self.testUniqueUsers = read_interaction_file(test_file)
+        self.testDataSize = len(self.testItem)
+        if self.testDataSize:
+            self.m_item = max(self.m_item, int(self.testItem.max()))
+            self.n_user = max(self.n_user, int(self.testUser.max()))
+
         if os.path.exists(valid_file):
-            with open(valid_file) as f:
-                for l in f.readlines():
-                    if len(l) > 0:
-                        l = l.strip('\n').split(' ')
-                        if l[1]:
-                            items = [int(i) for i in l[1:]]
-                            uid = int(l[0])
-                            validUniqueUsers.append(uid)
-                            validUser.extend([uid] * len(items))
-                            validItem.extend(items)
-                            self.m_item = max(self.m_item, max(items))
-                            self.n_user = max(self.n_user, uid)
-                            self.validDataSize += len(items)
-            self.validUniqueUsers = np.array(validUniqueUsers)
-            self.validUser = np.array(validUser)
-            self.validItem = np.array(validItem)
+            self.validUser, self.validItem, self.validUniqueUsers = read_interaction_file(valid_file)
+            self.validDataSize = len(self.validItem)
+            if self.validDataSize:
+                self.m_item = max(self.m_item, int(self.validItem.max()))
+                self.n_user = max(self.n_user, int(self.validUser.max()))
         
         self.m_item += 1
         self.n_user += 1
-        
-        #TODO 补全（在没划分valid的train.txt中全部的item都出现过了？？？——这样的数据集是怎样划分的？我直接随机把train拆出来valid是不是不妥？？？？）
-        for i in range(self.m_item):
-            if i not in self._TrainPop_item.keys():
-                # self._TrainPop_item[i] = 0
-                self._TrainPop_item[i] = 1 #如果“在没划分valid的train.txt中全部的item都出现过了”，那在train_7.txt中没出现的，应该在train.txt中至少有1的热度
 
+        item_degree = np.bincount(self.trainItem, minlength=self.m_item)
+        user_degree = np.bincount(self.trainUser, minlength=self.n_user)
+        #keep the order in which items/users first appear in train.txt, ties in Pop are broken by it
+        self._TrainPop_item = dict(zip(*_first_seen(self.trainItem, item_degree)))#item's popularity (degree) in the training dataset
+        self._TrainPop_user = dict(zip(*_first_seen(self.trainUser, user_degree)))#user's popularity (degree) in the training dataset
+        #TODO 补全（在没划分valid的train.txt中全部的item都出现过了？？？——这样的数据集是怎样划分的？我直接随机把train拆出来valid是不是不妥？？？？）
+        #如果“在没划分valid的train.txt中全部的item都出现过了”，那在train_7.txt中没出现的，应该在train.txt中至少有1的热度
+        self._TrainPop_item.update(dict.fromkeys(np.flatnonzero(item_degree == 0).tolist(), 1))
 
+        self._allPos = group_by(self.trainUser, self.trainItem)
+        self._allPos_item = group_by(self.trainItem, self.trainUser)
+        #================Pop=================#
 
         self.Graph = None
         print(f"{self.trainDataSize} interactions for training")
@@ -301,28 +286,14 @@ class dataset(Dataset):
         return:
             dict: {user: [items]}
         """
-        test_data = {}
-        for i, item in enumerate(self.testItem):
-            user = self.testUser[i]
-            if test_data.get(user):
-                test_data[user].append(item)
-            else:
-                test_data[user] = [item]
-        return test_data
+        return group_by(self.testUser, self.testItem)
     
     def __build_valid(self):
         """
         return:
             dict: {user: [items]}
         """
-        valid_data = {}
-        for i, item in enumerate(self.validItem):
-            user = self.validUser[i]
-            if valid_data.get(user):
-                valid_data[user].append(item)
-            else:
-                valid_data[user] = [item]
-        return valid_data
+        return group_by(self.validUser, self.validItem)
 
     def getUserItemFeedback(self, users, items):
         """
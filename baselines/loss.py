@@ -104,8 +104,8 @@ class BC_loss():
 
     def bc_loss(self, users_emb, pos_emb, userEmb0, posEmb0, batch_target, batch_pos, mode):
         #只使用正样本（一个user的正样本往往是其他user的负样本），无需负采样
-        users_pop = torch.tensor(self.precalculate.popularity.user_pop_degree_label).to(world.device)[batch_target]
-        pos_items_pop = torch.tensor(self.precalculate.popularity.item_pop_degree_label).to(world.device)[batch_pos]
+        users_pop = self.precalculate.features.user_degree[batch_target]
+        pos_items_pop = self.precalculate.features.item_degree[batch_pos]
         bc_loss, pop_loss, reg_pop_emb_loss, reg_pop_loss, reg_emb_loss = self.calculate_loss(users_emb, pos_emb, userEmb0, posEmb0, users_pop, pos_items_pop)
         if mode == 'only_bc':
             loss = bc_loss + reg_emb_loss
@@ -265,11 +265,14 @@ class Adaptive_softmax_loss(torch.nn.Module):
         return loss
 
 
-    def get_popdegree(self, batch_user, batch_pos_item):
-        with torch.no_grad():
-            pop_user = torch.tensor(self.precal.popularity.user_pop_degree_label).to(world.device)[batch_user]
-            pop_item = torch.tensor(self.precal.popularity.item_pop_degree_label).to(world.device)[batch_pos_item]
-        return pop_user, pop_item
+    def get_popdegree(self, batch_user, batch_pos_item, log=False):
+        '''
+        degree (or log degree) of the batch, gathered from the feature store on world.device
+        '''
+        features = self.precal.features
+        if log:
+            return features.user_log_degree[batch_user], features.item_log_degree[batch_pos_item]
+        return features.user_degree[batch_user], features.item_degree[batch_pos_item]
     
     def get_centroid(self, batch_user, batch_pos_item, centroid='eigenvector', aggr='mean', mode='GCA'):
         with torch.no_grad():
@@ -313,11 +316,10 @@ class Adaptive_softmax_loss(torch.nn.Module):
 
         elif method == 'mlp':
             # batch_weight_emb_user, batch_weight_emb_item = self.get_embs_perturb(batch_user, batch_pos_item)
-            batch_weight_pop_user, batch_weight_pop_item = self.get_popdegree(batch_user, batch_pos_item)
+            batch_weight_pop_user, batch_weight_pop_item = self.get_popdegree(batch_user, batch_pos_item, log=True)
             # batch_weight_pop_user = torch.ones_like(batch_weight_pop_user)*math.log(self.precal.popularity.max_pop_u)-torch.log(batch_weight_pop_user)#TODO problem of grandeur and +-
             # batch_weight_pop_item = torch.ones_like(batch_weight_pop_item)*math.log(self.precal.popularity.max_pop_i)-torch.log(batch_weight_pop_item)
             #batch_weight_homophily = self.get_homophily(batch_user, batch_pos_item)
-            batch_weight_pop_user, batch_weight_pop_item = torch.log(batch_weight_pop_user), torch.log(batch_weight_pop_item)
             batch_weight_centroid = self.get_centroid(batch_user, batch_pos_item, centroid=mode, aggr='mean', mode='GCA')
             batch_weight_commonNeighbor1, batch_weight_commonNeighbor2 = self.get_commonNeighbor(batch_user, batch_pos_item)
             features = [batch_weight_pop_user, batch_weight_pop_item, batch_weight_centroid, batch_weight_commonNeighbor1, batch_weight_commonNeighbor2]
@@ -405,10 +407,8 @@ class Causal_popularity_BPR_loss():
         reg_loss = (1/2)*(userEmb0.norm(2).pow(2) + posEmb0.norm(2).pow(2) + negEmb0.norm(2).pow(2))
         reg_loss = reg_loss * self.config['weight_decay']
 
-        pos_items_pop = torch.tensor(self.precalculate.popularity.item_pop_degree_label).to(world.device)[batch_pos]
-        neg_items_pop = torch.tensor(self.precalculate.popularity.item_pop_degree_label).to(world.device)[batch_neg]
-        norm_pos_items_pop = pos_items_pop / self.precalculate.popularity.item_pop_sum
-        norm_neg_items_pop = neg_items_pop / self.precalculate.popularity.item_pop_sum
+        norm_pos_items_pop = self.precalculate.features.item_norm_pop[batch_pos]
+        norm_neg_items_pop = self.precalculate.features.item_norm_pop[batch_neg]
         norm_pos_items_pop = norm_pos_items_pop ** self.gamma
         norm_neg_items_pop = norm_neg_items_pop ** self.gamma
 
@@ -496,7 +496,7 @@ class Classifier(torch.nn.Module):
         super(Classifier, self).__init__()
         self.input_dim = input_dim
 
-        self.all_label = precal.popularity.item_pop_group_label
+        self.all_label = precal.features.item_group
         
         self.net = torch.nn.Sequential(
             torch.nn.Linear(input_dim, input_dim*4),
@@ -515,8 +515,7 @@ class Classifier(torch.nn.Module):
         '''
         return loss and test accuracy of the same batch before update
         '''
-        batch_item = batch_item.cpu()
-        batch_label = torch.tensor(self.all_label[batch_item]).to(world.device)
+        batch_label = self.all_label[batch_item.to(self.all_label.device)]
         outputs = self.net(inputs)
         CE_loss = self.criterion(outputs, batch_label)
 
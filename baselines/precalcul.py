@@ -23,6 +23,7 @@ class precalculate():
     def __init__(self, config, dataset):
         
         self.P = Pop(dataset)
+        self.F = PopFeatures(self.P)
         self.C = None
         self.CN = None
         
@@ -37,6 +38,10 @@ class precalculate():
     def popularity(self):
         return self.P
     
+    @property
+    def features(self):
+        return self.F
+
     @property
     def centroid(self):
         return self.C
@@ -282,6 +287,29 @@ class Pop():
         pop_bias_Dict = {}
         return pop_bias_Dict
 
+#=============================================================Popularity Features============================================================#
+class PopFeatures():
+    """
+    popularity features of users and items kept on world.device, the losses only gather from them by index
+    """
+    def __init__(self, pop:Pop, device=world.device):
+        self.device = device
+        self.refresh(pop)
+
+    def refresh(self, pop:Pop):
+        '''
+        (re)build every tensor from pop, e.g. after interactions were added\n
+        degree and group are long (embedding / cross entropy indices), log_degree and norm_pop are float32
+        '''
+        self.user_degree = torch.as_tensor(np.asarray(pop.user_pop_degree_label, dtype=np.int64)).to(self.device)
+        self.item_degree = torch.as_tensor(np.asarray(pop.item_pop_degree_label, dtype=np.int64)).to(self.device)
+        self.user_log_degree = torch.log(self.user_degree.float())
+        self.item_log_degree = torch.log(self.item_degree.float())
+        self.user_group = torch.as_tensor(np.asarray(pop.user_pop_group_label, dtype=np.int64)).to(self.device)
+        self.item_group = torch.as_tensor(np.asarray(pop.item_pop_group_label, dtype=np.int64)).to(self.device)
+        self.user_norm_pop = self.user_degree.float() / self.user_degree.sum()
+        self.item_norm_pop = self.item_degree.float() / pop.item_pop_sum
+
 #=============================================================Node & Edge Centroid============================================================#
 class Centroid():
     def __init__(self, dataset:dataset, pop:Pop):
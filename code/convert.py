@@ -0,0 +1,235 @@
+"""
+Streaming converters from CSV/TSV logs and RecBole atomic files (.inter) into the binary dataset cache (datacache.py).\n
+    python convert.py --format inter --train ml.train.inter --test ml.test.inter --dataset_dir ../data/ml\n
+Files are cut into line-aligned byte ranges that a pool of processes parses, (user, item) pairs are deduplicated
+per split and the CSR goes straight into memory-mapped .npy files: memory is bounded by the number of distinct ids,
+not by the size of the logs. Raw ids (numbers or strings) are compacted to dense ids, raw_user_ids/raw_item_ids keep them.
+csv lines are read with the csv module (quoted fields may contain commas), but a record must fit on one line:
+quoted fields with line breaks are not supported since the files are cut at line ends.\n
+dataloader.dataset finds the cache through <dataset_dir>/converted.json when the folder has no train.txt.
+Kept free of `world` like datacache.py.
+
+@author: Guanming Chen (emilien_chen@buaa.edu.cn)
+Created on Dec 18, 2022
+"""
+import os
+import csv
+import json
+import argparse
+import multiprocessing
+import numpy as np
+import datacache
+
+CONVERTED_FILE = 'converted.json'
+CHUNK_BYTES = datacache.CHUNK_BYTES
+CHUNK_EDGES = datacache.CHUNK_EDGES
+SEPARATORS = {'csv': ',', 'tsv': '\t', 'inter': '\t'}
+
+_vocab = {}#set in the workers of the second pass, see _init_vocab
+
+
+def split_lines(lines, sep):
+    '''
+    fields of every non-empty line, csv goes through the csv module so that quoted fields may hold the separator
+    '''
+    lines = [line for line in lines if line.strip()]
+    if sep == ',':
+        return list(csv.reader(lines))
+    return [line.split(sep) for line in lines]
+
+def read_columns(file, fmt, user_col, item_col):
+    '''
+    return: (position of user_col, position of item_col, size of the header in bytes)\n
+    RecBole headers carry a type, "user_id:token", which is ignored.
+    '''
+    with open(file, 'rb') as f:
+        header = f.readline()
+    names = [name.strip().strip('"').split(':')[0] for name in split_lines([header.decode('utf-8')], SEPARATORS[fmt])[0]]
+    for col in [user_col, item_col]:
+        if col not in names:
+            raise ValueError(f'{file}: no column {col} in header {names}')
+    return names.index(user_col), names.index(item_col), len(header)
+
+def byte_ranges(file, start, chunk_bytes=CHUNK_BYTES):
+    '''
+    [begin, end) ranges covering file from start, a range parses the lines that begin inside it
+    '''
+    size = os.path.getsize(file)
+    bounds = list(range(start, size, chunk_bytes)) + [size]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def parse_range(file, begin, end, first, sep, user_pos, item_pos):
+    '''
+    raw user and item tokens of the lines starting in [begin, end), as numpy string arrays
+    '''
+    with open(file, 'rb') as f:
+        if begin > first:
+            f.seek(begin - 1)
+            f.readline()#the line that began before begin belongs to the previous range
+        else:
+            f.seek(begin)
+        data = f.read(max(0, end - f.tell()))
+        if data and not data.endswith(b'\n'):
+            data += f.readline()
+    rows = split_lines(data.decode('utf-8').splitlines(), sep)
+    users = np.array([row[user_pos].strip().strip('"') for row in rows], dtype=str)
+    items = np.array([row[item_pos].strip().strip('"') for row in rows], dtype=str)
+    return users, items
+
+def _count_range(task):
+    users, items = parse_range(*task)
+    return np.unique(users, return_counts=True) + (np.unique(items),)
+
+def _init_vocab(vocab):
+    _vocab.update(vocab)
+
+def _map_range(task):
+    users, items = parse_range(*task)
+    return to_dense(_vocab['user'], users), to_dense(_vocab['item'], items)
+
+def build_vocab(tokens):
+    '''
+    tokens: sorted distinct raw tokens\n
+    return: (tokens, dense id of every token, raw id of every dense id).
+    Tokens that are all plain integers get dense ids in numeric order and int64 raw ids, others keep string order.
+    '''
+    numeric = len(tokens) > 0 and np.char.isdigit(tokens).all() and \
+        ((np.char.str_len(tokens) == 1) | ~np.char.startswith(tokens, '0')).all()
+    if not numeric:
+        return tokens, np.arange(len(tokens)), tokens
+    raw = tokens.astype(np.int64)
+    order = np.argsort(raw, kind='stable')
+    dense = np.empty(len(tokens), dtype=np.int64)
+    dense[order] = np.arange(len(tokens))
+    return tokens, dense, raw[order]
+
+def to_dense(vocab, tokens):
+    tokens_sorted, dense, _ = vocab
+    return dense[np.searchsorted(tokens_sorted, tokens)]
+
+def _dedup_csr(folder, name, indptr, indices, m_item, chunk=CHUNK_EDGES):
+    '''
+    drop repeated (user, item) pairs of a CSR, the first occurrence is kept and the order inside a user does not change\n
+    return: (indptr, indices) of the deduplicated CSR, indices is <name>.npy in folder
+    '''
+    E = len(indices)
+    out = datacache.open_array(folder, name, datacache.ID_DTYPE, (E,))
+    degree = np.zeros(len(indptr) - 1, dtype=np.int64)
+    n_kept = 0
+    for u0, u1 in datacache.user_blocks(indptr, chunk):
+        e0, e1 = indptr[u0], indptr[u1]
+        users = np.repeat(np.arange(u0, u1), np.diff(indptr[u0:u1+1]))
+        items = np.asarray(indices[e0:e1])
+        _, first = np.unique(users * m_item + items, return_index=True)
+        keep = np.sort(first)
+        out[n_kept:n_kept+len(keep)] = items[keep]
+        degree[u0:u1] = np.bincount(users[keep] - u0, minlength=u1 - u0)
+        n_kept += len(keep)
+    out.flush()
+    if n_kept < E:
+        out_exact = datacache.open_array(folder, name + '.exact', datacache.ID_DTYPE, (n_kept,))
+        for start in range(0, n_kept, chunk):
+            out_exact[start:start+chunk] = out[start:min(start+chunk, n_kept)]
+        out_exact.flush()
+        del out
+        os.replace(os.path.join(folder, name + '.exact.npy'), os.path.join(folder, name + '.npy'))
+        out = out_exact
+    return np.concatenate(([0], np.cumsum(degree))), out
+
+def convert(files, cache_dir, fmt='csv', user_col='user_id', item_col='item_id',
+            workers=None, chunk_bytes=CHUNK_BYTES, chunk=CHUNK_EDGES):
+    '''
+    files: {split: path} with split in train, test, valid\n
+    Pass 1 collects the distinct ids and the number of interactions of every user,
+    pass 2 maps tokens to dense ids and scatters every range into the memory-mapped CSR of its split (counting sort),
+    then repeated pairs are dropped. The cache has the same arrays as the one built from train.txt/test.txt.
+    '''
+    sep = SEPARATORS[fmt]
+    tasks = {}
+    for split, file in files.items():
+        user_pos, item_pos, first = read_columns(file, fmt, user_col, item_col)
+        tasks[split] = [(file, begin, end, first, sep, user_pos, item_pos) for begin, end in byte_ranges(file, first, chunk_bytes)]
+    workers = workers or os.cpu_count()
+
+    user_tokens, item_tokens = np.zeros(0, dtype=str), np.zeros(0, dtype=str)
+    counts = {}
+    with multiprocessing.Pool(workers) as pool:
+        for split in files:
+            split_users, split_counts = np.zeros(0, dtype=str), np.zeros(0, dtype=np.int64)
+            for users, user_counts, items in pool.imap(_count_range, tasks[split]):
+                split_users, split_counts = datacache.merge_counts(split_users, split_counts, users, user_counts)
+                item_tokens = np.union1d(item_tokens, items)
+            user_tokens = np.union1d(user_tokens, split_users)
+            counts[split] = split_users, split_counts
+    vocab = {'user': build_vocab(user_tokens), 'item': build_vocab(item_tokens)}
+    n_user, m_item = len(user_tokens), len(item_tokens)
+    assert n_user + m_item <= np.iinfo(datacache.ID_DTYPE).max, 'too many nodes for ID_DTYPE'
+
+    tmp_dir = datacache.begin(cache_dir)
+    names = ['raw_user_ids', 'raw_item_ids']
+    np.save(os.path.join(tmp_dir, 'raw_user_ids.npy'), vocab['user'][2])
+    np.save(os.path.join(tmp_dir, 'raw_item_ids.npy'), vocab['item'][2])
+    n_duplicates = 0
+    with multiprocessing.Pool(workers, initializer=_init_vocab, initargs=(vocab,)) as pool:
+        for split in files:
+            degree = np.zeros(n_user, dtype=np.int64)
+            degree[to_dense(vocab['user'], counts[split][0])] = counts[split][1]
+            indptr = np.concatenate(([0], np.cumsum(degree)))
+            indices = datacache.open_array(tmp_dir, f'{split}_scratch', datacache.ID_DTYPE, (indptr[-1],))
+            fill = indptr[:-1].copy()
+            for users, items in pool.imap(_map_range, tasks[split]):
+                datacache.scatter_by_key(indices, fill, users, items)
+            indices.flush()
+            E = len(indices)
+            name = 'train_indices' if split == 'train' else f'{split}_item'
+            indptr, indices = _dedup_csr(tmp_dir, name, indptr, indices, m_item, chunk)
+            os.remove(os.path.join(tmp_dir, f'{split}_scratch.npy'))
+            n_duplicates += E - len(indices)
+            if split == 'train':
+                np.save(os.path.join(tmp_dir, 'train_indptr.npy'), indptr)
+                names += ['train_indptr', 'train_indices']
+                continue
+            #test/valid are stored flat like parsed text files, grouped by user
+            split_user = datacache.open_array(tmp_dir, f'{split}_user', datacache.ID_DTYPE, (len(indices),))
+            for start in range(0, len(indices), chunk):
+                split_user[start:start+chunk] = np.searchsorted(indptr, np.arange(start, min(start+chunk, len(indices))), side='right') - 1
+            split_user.flush()
+            np.save(os.path.join(tmp_dir, f'{split}_unique_users.npy'), np.flatnonzero(np.diff(indptr)).astype(datacache.ID_DTYPE))
+            names += [f'{split}_user', f'{split}_item', f'{split}_unique_users']
+    meta = {'n_user': n_user, 'm_item': m_item,
+            'converted_from': {split: os.path.basename(file) for split, file in files.items()}, 'duplicates': int(n_duplicates)}
+    datacache.commit(tmp_dir, cache_dir, names, meta)
+    return meta
+
+def convert_dataset(dataset_dir, files, **kwargs):
+    '''
+    convert files into <dataset_dir>/cache/<hash of the files> and point <dataset_dir>/converted.json to it
+    '''
+    cache_key = datacache.source_hash([files[split] for split in sorted(files)], 'converted',
+                                      kwargs.get('fmt', 'csv'), kwargs.get('user_col', 'user_id'), kwargs.get('item_col', 'item_id'))
+    meta = convert(files, os.path.join(dataset_dir, 'cache', cache_key), **kwargs)
+    with open(os.path.join(dataset_dir, CONVERTED_FILE), 'w') as f:
+        json.dump({'cache': cache_key, 'valid': 'valid' in files, 'files': meta['converted_from']}, f)
+    return cache_key, meta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert CSV/TSV/RecBole .inter interaction logs into the binary dataset cache")
+    parser.add_argument('--format', type=str, default='csv', choices=list(SEPARATORS), help="csv (quoted fields allowed, one record per line), tsv or inter (RecBole atomic file)")
+    parser.add_argument('--train', type=str, required=True, help="training interactions")
+    parser.add_argument('--test', type=str, required=True, help="test interactions")
+    parser.add_argument('--valid', type=str, default=None, help="validation interactions, made by the dataloader from train if missing")
+    parser.add_argument('--dataset_dir', type=str, required=True, help="dataset folder, e.g. ../data/mydata")
+    parser.add_argument('--user_col', type=str, default='user_id', help="user column in the header")
+    parser.add_argument('--item_col', type=str, default='item_id', help="item column in the header")
+    parser.add_argument('--workers', type=int, default=0, help="parsing processes, 0 for all cores")
+    parser.add_argument('--chunk_mb', type=int, default=64, help="size of the byte ranges given to the workers")
+    args = parser.parse_args()
+    files = {'train': args.train, 'test': args.test}
+    if args.valid:
+        files['valid'] = args.valid
+    os.makedirs(args.dataset_dir, exist_ok=True)
+    cache_key, meta = convert_dataset(args.dataset_dir, files, fmt=args.format, user_col=args.user_col, item_col=args.item_col,
+                                      workers=args.workers or None, chunk_bytes=args.chunk_mb << 20)
+    print(f"{meta['n_user']} users, {meta['m_item']} items, {meta['duplicates']} duplicated pairs dropped")
+    print(f"cache {cache_key} written to {args.dataset_dir}")
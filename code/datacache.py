@@ -0,0 +1,154 @@
+"""
+Binary dataset cache: every array is an .npy file opened with np.load(mmap_mode='r'),
+so restarts skip text parsing and concurrent runs share pages through the OS page cache.
+Kept free of `world` so that offline scripts can write caches without parsing run arguments.
+
+@author: Guanming Chen (emilien_chen@buaa.edu.cn)
+Created on Dec 18, 2022
+"""
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+CACHE_VERSION = 2 #2: node ids stored as int32
+ID_DTYPE = np.int32 #node ids in the cache, see the dtype policy in dataloader.py
+CHUNK_BYTES = 1 << 26 #text read per block when files are parsed in parts (out-of-core mode, convert.py)
+CHUNK_EDGES = 1 << 24 #interactions handled per block by the chunked builders
+META_FILE = 'meta.json'
+
+
+def source_hash(files, *extra):
+    '''
+    content hash of the source files (in order), salted with extra keys such as the data split
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'v{CACHE_VERSION}'.encode())
+    for file in files:
+        h.update(os.path.basename(file).encode())
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 24), b''):
+                h.update(chunk)
+    for key in extra:
+        h.update(repr(key).encode())
+    return h.hexdigest()
+
+def chain_hash(base, *arrays):
+    '''
+    hash of base extended with the content of arrays, e.g. source_hash after interactions were appended
+    '''
+    h = hashlib.blake2b(base.encode(), digest_size=16)
+    for array in arrays:
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()
+
+def begin(cache_dir):
+    '''
+    return: temporary folder next to cache_dir to write arrays into, see open_array and commit
+    '''
+    tmp_dir = cache_dir + f'.tmp{os.getpid()}'
+    os.makedirs(tmp_dir, exist_ok=True)
+    return tmp_dir
+
+def open_array(folder, name, dtype, shape):
+    '''
+    writable memory-mapped <name>.npy in folder, for arrays that are filled chunk by chunk and never held in RAM
+    '''
+    shape = tuple(int(size) for size in shape) #numpy scalars would end up as np.int64(...) in the .npy header
+    return np.lib.format.open_memmap(os.path.join(folder, name + '.npy'), mode='w+', dtype=dtype, shape=shape)
+
+def commit(tmp_dir, cache_dir, names, meta):
+    '''
+    write meta.json and move tmp_dir (from begin) to cache_dir in one rename
+    '''
+    meta = dict(meta, version=CACHE_VERSION, arrays=sorted(names))
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.replace(tmp_dir, cache_dir)
+
+def save(cache_dir, arrays, meta):
+    '''
+    write arrays as <name>.npy and meta.json into cache_dir.\n
+    Files go to a temporary folder first and are renamed at the end, so a crashed run never leaves a half-written cache.
+    '''
+    tmp_dir = begin(cache_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), np.ascontiguousarray(array))
+    commit(tmp_dir, cache_dir, arrays, meta)
+
+def register(cache_dir, names):
+    '''
+    add arrays that were written into an existing cache_dir afterwards (e.g. derived arrays) to its meta.json
+    '''
+    path = os.path.join(cache_dir, META_FILE)
+    with open(path) as f:
+        meta = json.load(f)
+    meta['arrays'] = sorted(set(meta['arrays']) | set(names))
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.tmp', path)
+
+def load(cache_dir):
+    '''
+    return: ({name: read-only memory-mapped array}, meta), or None if there is no valid cache in cache_dir
+    '''
+    try:
+        with open(os.path.join(cache_dir, META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    try:
+        arrays = {name: np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r') for name in meta['arrays']}
+    except (OSError, ValueError):
+        return None
+    return arrays, meta
+
+def scatter_by_key(out, fill, keys, values):
+    """
+    out[fill[key] + rank of the value among the same key] = values, then fill += counts.\n
+    One step of a counting sort, values of a key keep their order.
+    """
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    uniq, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    rank = np.arange(len(keys)) - np.repeat(first, counts)
+    out[fill[keys] + rank] = values[order]
+    fill[uniq] += counts
+
+def merge_counts(keys, counts, new_keys, new_counts):
+    """
+    add (new_keys, new_counts) into the sorted distinct keys and their counts
+    """
+    keys, inverse = np.unique(np.concatenate((keys, new_keys)), return_inverse=True)
+    return keys, np.bincount(inverse, weights=np.concatenate((counts, new_counts)), minlength=len(keys)).astype(np.int64)
+
+def user_blocks(indptr, chunk):
+    """
+    (u0, u1) ranges of whole users with about chunk interactions each (a single bigger user gets its own block)
+    """
+    cuts = np.searchsorted(indptr, np.arange(0, indptr[-1], chunk), side='right') - 1
+    cuts = np.unique(np.concatenate(([0], cuts, [len(indptr) - 1])))
+    return zip(cuts[:-1], cuts[1:])
+
+def merge_sorted(outs, old_block, n_old, news, new_keys, chunk):
+    """
+    outs[i] = the n_old old entries and news[i] merged by key, chunk old entries at a time (the old arrays can be memory-mapped,
+    news fit in memory). Old entries come first on equal keys.\n
+    old_block(a, b): (sorted keys of the old entries a:b, [their values for every out]); new_keys: sorted keys of news
+    """
+    before_new = np.zeros(len(new_keys), dtype=np.int64)#old entries placed before every new one
+    for a in range(0, n_old, chunk):
+        b = min(a + chunk, n_old)
+        keys, values = old_block(a, b)
+        pos = np.arange(a, b) + np.searchsorted(new_keys, keys, side='left')
+        for out, value in zip(outs, values):
+            out[pos] = value
+        before_new += np.searchsorted(keys, new_keys, side='right')
+    pos = np.arange(len(new_keys)) + before_new
+    for out, new in zip(outs, news):
+        out[pos] = new
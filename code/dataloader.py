@@ -5,6 +5,7 @@
 Created on Dec 18, 2022
 """
 import os
+import json
 from os.path import join
 import random
 from scipy.sparse import csr_matrix
@@ -16,11 +17,698 @@ from torch.utils.data import Dataset, DataLoader
 #自定义的数据集继承自Dataset，必须重写的方法:__init__()读取数据, __len__()自定义数据集的长度, __getitem__()对自定义数据集进行索引
 #用Dataset制作好数据集后交给DataLoader可以自动输出每个batch的数据及标签
 import world
+import datacache
+from convert import CONVERTED_FILE
 from world import cprint
 from time import time
-import networkx as nx
+from concurrent.futures import ThreadPoolExecutor
 from torch_geometric.data import Data
 
+ADJ_MAT_VERSION = 1 #bump when build_norm_adj changes, cached s_pre_adj_mat.npz are then rebuilt
+CHUNK_BYTES = datacache.CHUNK_BYTES #text read per block in out-of-core mode
+CHUNK_EDGES = datacache.CHUNK_EDGES #interactions handled per block in out-of-core mode
+#dtype policy: node ids (users, items, user/item columns of the CSR) are int32, offsets, edge ids and user*m_item+item keys
+#are int64, values (normalized adjacency, features) float32, the interaction matrix is bool.
+#ids are widened to int64 only where torch needs it (edge_index for PyG, index tensors on the device).
+ID_DTYPE = datacache.ID_DTYPE
+PARALLEL_NNZ = 1 << 20 #GraphView.matvec uses the thread pool from this number of edges on
+VALID_RATIO = 1 / 8 #train_7.txt : valid_1.txt, share of a user's interactions held out by split_arrays
+
+def read_interaction_file(file):
+    """
+    Parse a whole "uid item item ..." file at once.\n
+    return: users, items (one entry per interaction) and the users that own a non-empty line, all in file order.
+    """
+    with open(file, 'rb') as f:
+        return parse_interactions(f.read(), file)
+
+def iter_interaction_file(file, chunk_bytes=CHUNK_BYTES):
+    """
+    read_interaction_file block by block, each block ends on a line break so no line is cut.\n
+    Memory stays O(chunk_bytes) whatever the size of the file.
+    """
+    rest = b''
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_bytes), b''):
+            block = rest + block
+            cut = block.rfind(b'\n') + 1
+            rest = block[cut:]
+            if cut:
+                yield parse_interactions(block[:cut], file)
+    if rest.strip():
+        yield parse_interactions(rest, file)
+
+def parse_interactions(raw, file=''):
+    """
+    see read_interaction_file, raw is the content of whole lines
+    """
+    tokens = np.fromstring(raw, dtype=np.int64, sep=' ')
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    is_sep = buf <= ord(' ')
+    token_start = ~is_sep
+    token_start[1:] &= is_sep[:-1]
+    token_line = np.cumsum(buf == ord('\n'))[token_start]
+    assert len(token_line) == len(tokens), f'{file} contains non integer tokens'
+
+    is_uid = np.ones(len(tokens), dtype=bool)
+    is_uid[1:] = token_line[1:] != token_line[:-1]
+    line_uid = tokens[is_uid]
+    token_owner = np.cumsum(is_uid)[~is_uid] - 1
+    users = line_uid[token_owner]
+    items = tokens[~is_uid]
+    unique_users = line_uid[np.bincount(token_owner, minlength=len(line_uid)) > 0]
+    return users, items, unique_users
+
+def group_by(keys, values):
+    """
+    return:
+        dict: {key: array of values}, keys in order of first appearance, values keep their order (stable sort)
+    """
+    order = np.argsort(keys, kind='stable')
+    uniq, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    groups = np.split(values[order], np.cumsum(counts)[:-1])
+    return {uniq[g].item(): groups[g] for g in np.argsort(first)}
+
+def chunked_bincount(x, minlength=0, chunk=CHUNK_EDGES):
+    """
+    np.bincount over slices of x, a memory-mapped x is never copied as a whole
+    """
+    count = np.zeros(minlength, dtype=np.int64)
+    for start in range(0, len(x), chunk):
+        part = np.bincount(x[start:start+chunk])
+        if len(part) > len(count):
+            count = np.pad(count, (0, len(part) - len(count)))
+        count[:len(part)] += part
+    return count
+
+def _first_seen(keys, degree, chunk=CHUNK_EDGES):
+    """
+    return: keys in order of first appearance and their degree, as lists\n
+    keys < len(degree), scanned by slices so that keys may be memory-mapped
+    """
+    first = np.full(len(degree), len(keys), dtype=np.int64)
+    for start in range(0, len(keys), chunk):
+        uniq, idx = np.unique(keys[start:start+chunk], return_index=True)
+        first[uniq] = np.minimum(first[uniq], idx + start)
+    seen = np.flatnonzero(first < len(keys))
+    seen = seen[np.argsort(first[seen], kind='stable')]
+    return seen.tolist(), degree[seen].tolist()
+
+def _raw_ids(raw, compact):
+    """
+    raw: sorted distinct raw ids\n
+    return: raw id of every dense id, raw itself if compact else 0..max(raw) (dense id == raw id)
+    """
+    if compact:
+        return raw
+    return np.arange(int(raw[-1]) + 1 if len(raw) else 1, dtype=np.int64)
+
+def build_arrays(train_file, test_file, valid_file=None, compact=False):
+    """
+    Parse the text files into the arrays stored in the binary cache.\n
+    Training interactions are stably sorted by user, i.e. CSR train_indptr/train_indices.\n
+    compact: map the raw ids seen in any split to dense 0..n-1 (order kept), raw_user_ids/raw_item_ids translate back
+    """
+    arrays = {}
+    splits = []
+    for split, file in [('train', train_file), ('test', test_file), ('valid', valid_file)]:
+        if file is None or not os.path.exists(file):
+            continue
+        arrays[f'{split}_user'], arrays[f'{split}_item'], arrays[f'{split}_unique_users'] = read_interaction_file(file)
+        splits.append(split)
+    raw_users = _raw_ids(np.unique(np.concatenate([arrays[f'{split}_user'] for split in splits])), compact)
+    raw_items = _raw_ids(np.unique(np.concatenate([arrays[f'{split}_item'] for split in splits])), compact)
+    n_user, m_item = len(raw_users), len(raw_items)
+    assert n_user + m_item <= np.iinfo(ID_DTYPE).max, 'too many nodes for ID_DTYPE'
+    for split in splits:
+        for name, raw in [('user', raw_users), ('item', raw_items), ('unique_users', raw_users)]:
+            arrays[f'{split}_{name}'] = np.searchsorted(raw, arrays[f'{split}_{name}'])
+    if compact:
+        arrays['raw_user_ids'], arrays['raw_item_ids'] = raw_users, raw_items
+
+    users, items = arrays.pop('train_user'), arrays.pop('train_item')
+    del arrays['train_unique_users']
+    order = np.argsort(users, kind='stable')
+    arrays['train_indptr'] = np.concatenate(([0], np.cumsum(np.bincount(users, minlength=n_user))))
+    arrays['train_indices'] = items[order].astype(ID_DTYPE)
+    for name in list(arrays):
+        if name != 'train_indptr' and not name.startswith('raw_'):
+            arrays[name] = arrays[name].astype(ID_DTYPE)
+    return arrays, {'n_user': n_user, 'm_item': m_item}
+
+def stream_build_arrays(train_file, test_file, valid_file, cache_dir, chunk_bytes=CHUNK_BYTES, compact=False):
+    """
+    build_arrays for logs larger than memory, written straight into the cache folder:\n
+    pass 1 collects the distinct ids and counts the interactions of every user, pass 2 scatters the items of each text block
+    to their CSR slot in the memory-mapped train_indices (an external counting sort, file order kept inside a user).
+    """
+    splits = [(split, file) for split, file in [('train', train_file), ('test', test_file), ('valid', valid_file)]
+              if file is not None and os.path.exists(file)]
+    sizes = {}
+    raw_users, raw_items = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    train_users, train_degree = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    for split, file in splits:
+        total, n_unique = 0, 0
+        for users, items, unique_users in iter_interaction_file(file, chunk_bytes):
+            raw_users = np.union1d(raw_users, users)
+            raw_items = np.union1d(raw_items, items)
+            total += len(items)
+            n_unique += len(unique_users)
+            if split == 'train':
+                train_users, train_degree = datacache.merge_counts(train_users, train_degree, *np.unique(users, return_counts=True))
+        sizes[split] = total, n_unique
+    raw_users, raw_items = _raw_ids(raw_users, compact), _raw_ids(raw_items, compact)
+    n_user, m_item = len(raw_users), len(raw_items)
+    assert n_user + m_item <= np.iinfo(ID_DTYPE).max, 'too many nodes for ID_DTYPE'
+
+    tmp_dir = datacache.begin(cache_dir)
+    names = []
+    if compact:
+        np.save(join(tmp_dir, 'raw_user_ids.npy'), raw_users)
+        np.save(join(tmp_dir, 'raw_item_ids.npy'), raw_items)
+        names += ['raw_user_ids', 'raw_item_ids']
+    for split, file in splits:
+        total, n_unique = sizes[split]
+        if split == 'train':
+            user_degree = np.zeros(n_user, dtype=np.int64)
+            user_degree[np.searchsorted(raw_users, train_users)] = train_degree
+            indptr = np.concatenate(([0], np.cumsum(user_degree)))
+            np.save(join(tmp_dir, 'train_indptr.npy'), indptr)
+            indices = datacache.open_array(tmp_dir, 'train_indices', ID_DTYPE, (total,))
+            fill = indptr[:-1].copy()
+            for users, items, _ in iter_interaction_file(file, chunk_bytes):
+                datacache.scatter_by_key(indices, fill, np.searchsorted(raw_users, users), np.searchsorted(raw_items, items))
+            indices.flush()
+            names += ['train_indptr', 'train_indices']
+            continue
+        out = {name: datacache.open_array(tmp_dir, f'{split}_{name}', ID_DTYPE, (size,))
+               for name, size in [('user', total), ('item', total), ('unique_users', n_unique)]}
+        pos = {name: 0 for name in out}
+        for chunk in iter_interaction_file(file, chunk_bytes):
+            for name, values, raw in zip(['user', 'item', 'unique_users'], chunk, [raw_users, raw_items, raw_users]):
+                out[name][pos[name]:pos[name]+len(values)] = np.searchsorted(raw, values)
+                pos[name] += len(values)
+        for name, array in out.items():
+            array.flush()
+            names.append(f'{split}_{name}')
+    datacache.commit(tmp_dir, cache_dir, names, {'n_user': n_user, 'm_item': m_item})
+
+def _edge_random(seed, positions):
+    """
+    splitmix64 of (seed, position), random keys that depend on the edge only and not on how edges are chunked
+    """
+    x = positions.astype(np.uint64) + np.uint64((seed * 0x9E3779B97F4A7C15) % (1 << 64))
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def split_arrays(arrays, meta, seed, valid_ratio=VALID_RATIO, alloc=None, chunk=CHUNK_EDGES):
+    """
+    Per-user holdout of the training interactions of a cache (train.txt) into train/valid, one pass over blocks of users:\n
+    every user gives round(valid_ratio * degree) interactions (at most degree-1) to valid, picked by random keys of (seed, edge)
+    so the split is reproducible and does not depend on chunk. Both parts keep the file order inside a user.\n
+    alloc(name, dtype, shape): where the output arrays live, memory-mapped files in out-of-core mode\n
+    return: (arrays, meta) of the split cache, test and raw id arrays are taken over
+    """
+    alloc = alloc or (lambda name, dtype, shape: np.empty(shape, dtype=dtype))
+    indptr, indices = arrays['train_indptr'], arrays['train_indices']
+    degree = np.diff(indptr)
+    n_valid = np.minimum(np.rint(degree * valid_ratio).astype(np.int64), np.maximum(degree - 1, 0))
+    train_indptr = np.concatenate(([0], np.cumsum(degree - n_valid)))
+    valid_indptr = np.concatenate(([0], np.cumsum(n_valid)))
+    out = {'train_indptr': train_indptr,
+           'train_indices': alloc('train_indices', ID_DTYPE, (train_indptr[-1],)),
+           'valid_user': alloc('valid_user', ID_DTYPE, (valid_indptr[-1],)),
+           'valid_item': alloc('valid_item', ID_DTYPE, (valid_indptr[-1],)),
+           'valid_unique_users': np.flatnonzero(n_valid).astype(ID_DTYPE)}
+    for u0, u1 in datacache.user_blocks(indptr, chunk):
+        e0, e1 = indptr[u0], indptr[u1]
+        users = np.repeat(np.arange(u0, u1), degree[u0:u1])
+        order = np.lexsort((_edge_random(seed, np.arange(e0, e1)), users))
+        rank = np.empty(e1 - e0, dtype=np.int64)
+        rank[order] = np.arange(e1 - e0) - (indptr[users[order]] - e0)
+        is_valid = rank < n_valid[users]
+        items = np.asarray(indices[e0:e1])
+        out['train_indices'][train_indptr[u0]:train_indptr[u1]] = items[~is_valid]
+        out['valid_user'][valid_indptr[u0]:valid_indptr[u1]] = users[is_valid]
+        out['valid_item'][valid_indptr[u0]:valid_indptr[u1]] = items[is_valid]
+    for name in ['test_user', 'test_item', 'test_unique_users', 'raw_user_ids', 'raw_item_ids']:
+        if name in arrays:
+            out[name] = alloc(name, arrays[name].dtype, arrays[name].shape)
+            for start in range(0, len(arrays[name]), chunk):
+                out[name][start:start+chunk] = arrays[name][start:start+chunk]
+    return out, dict(meta, split={'seed': seed, 'valid_ratio': valid_ratio})
+
+def write_split_arrays(arrays, meta, seed, cache_dir):
+    """
+    split_arrays written straight into cache_dir as memory-mapped files, for out-of-core mode
+    """
+    tmp_dir = datacache.begin(cache_dir)
+    out, meta = split_arrays(arrays, meta, seed, alloc=lambda name, dtype, shape: datacache.open_array(tmp_dir, name, dtype, shape))
+    for name, array in out.items():
+        if isinstance(array, np.memmap):
+            array.flush()
+        else:
+            np.save(join(tmp_dir, name + '.npy'), array)
+    datacache.commit(tmp_dir, cache_dir, out, meta)
+
+def build_out_of_core_arrays(cache_dir, arrays, meta, chunk=CHUNK_EDGES):
+    """
+    Arrays derived from the train CSR that out-of-core mode reads instead of in-memory structures,
+    computed slice by slice and added to the cache:\n
+        train_user: owner of every entry of train_indices\n
+        edge_keys/edge_order: sorted user*m_item+item keys and their edge ids, see EdgeIndex.from_sorted\n
+        pos_indptr/pos_indices: CSR of the distinct items of every user in ascending order (as UserItemNet)\n
+        item_indptr/item_indices: CSC of the same, users of an item in ascending order
+    """
+    n_user, m_item = meta['n_user'], meta['m_item']
+    indptr, indices = arrays['train_indptr'], arrays['train_indices']
+    E = len(indices)
+    names = []
+    def open_array(name, dtype, shape):
+        names.append(name)
+        return datacache.open_array(cache_dir, name + '.tmp', dtype, shape)
+    def save_array(name, array):
+        names.append(name)
+        np.save(join(cache_dir, name + '.tmp.npy'), array)
+
+    if 'train_user' not in arrays:
+        train_user = open_array('train_user', ID_DTYPE, (E,))
+        for start in range(0, E, chunk):
+            train_user[start:start+chunk] = np.searchsorted(indptr, np.arange(start, min(start+chunk, E)), side='right') - 1
+        train_user.flush()
+    else:
+        train_user = arrays['train_user']
+
+    if 'edge_keys' not in arrays:
+        #blocks of whole users, so sorting every block sorts the keys globally
+        edge_keys = open_array('edge_keys', np.int64, (E,))
+        edge_order = open_array('edge_order', np.int64, (E,))
+        pos_items = datacache.open_array(cache_dir, 'pos_scratch.tmp', ID_DTYPE, (E,))
+        pos_degree = np.zeros(n_user, dtype=np.int64)
+        n_pos = 0
+        for u0, u1 in datacache.user_blocks(indptr, chunk):
+            e0, e1 = indptr[u0], indptr[u1]
+            keys = np.asarray(train_user[e0:e1], dtype=np.int64) * m_item + np.asarray(indices[e0:e1])
+            order = np.argsort(keys, kind='stable')
+            keys = keys[order]
+            edge_keys[e0:e1] = keys
+            edge_order[e0:e1] = order + e0
+            keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))] if len(keys) else keys
+            pos_items[n_pos:n_pos+len(keys)] = keys % m_item
+            pos_degree[u0:u1] = np.bincount(keys // m_item - u0, minlength=u1 - u0)
+            n_pos += len(keys)
+        edge_keys.flush()
+        edge_order.flush()
+        pos_indptr = np.concatenate(([0], np.cumsum(pos_degree)))
+        save_array('pos_indptr', pos_indptr)
+        if n_pos < E:#duplicated interactions, keep the distinct ones only
+            pos_indices = open_array('pos_indices', ID_DTYPE, (n_pos,))
+            for start in range(0, n_pos, chunk):
+                pos_indices[start:start+chunk] = pos_items[start:min(start+chunk, n_pos)]
+            pos_indices.flush()
+            del pos_items
+        else:
+            pos_items.flush()
+            pos_indices = pos_items
+            os.replace(join(cache_dir, 'pos_scratch.tmp.npy'), join(cache_dir, 'pos_indices.tmp.npy'))
+            names.append('pos_indices')
+
+        item_indptr = np.concatenate(([0], np.cumsum(chunked_bincount(pos_indices, m_item, chunk))))
+        item_indices = open_array('item_indices', ID_DTYPE, (n_pos,))
+        fill = item_indptr[:-1].copy()
+        for start in range(0, n_pos, chunk):
+            users = np.searchsorted(pos_indptr, np.arange(start, min(start+chunk, n_pos)), side='right') - 1
+            datacache.scatter_by_key(item_indices, fill, np.asarray(pos_indices[start:start+chunk]), users)
+        item_indices.flush()
+        save_array('item_indptr', item_indptr)
+
+    if names:
+        for name in names:
+            os.replace(join(cache_dir, name + '.tmp.npy'), join(cache_dir, name + '.npy'))
+        if os.path.exists(join(cache_dir, 'pos_scratch.tmp.npy')):
+            os.remove(join(cache_dir, 'pos_scratch.tmp.npy'))
+        datacache.register(cache_dir, names)
+        arrays, meta = datacache.load(cache_dir)
+    return arrays
+
+def append_out_of_core_arrays(cache_dir, arrays, n_old, m_old, users, items, n_new, m_new, chunk=CHUNK_EDGES):
+    """
+    Out-of-core arrays (see build_out_of_core_arrays) with the new edges (users[k], items[k]) appended, written to cache_dir
+    chunk by chunk, the old arrays are read slice by slice and never held in memory:\n
+        train_user/train_indices: the new edges at the end, existing edge ids stay valid (this layout has no train_indptr)\n
+        edge_keys/edge_order, pos_indptr/pos_indices, item_indptr/item_indices: merged with the new entries (datacache.merge_sorted)\n
+    users/items: pairs that are not edges yet, without repeats\n
+    return: the arrays of the new cache, memory-mapped
+    """
+    E_old, B = len(arrays['train_indices']), len(users)
+    users, items = np.asarray(users, dtype=np.int64), np.asarray(items, dtype=np.int64)
+    tmp_dir = datacache.begin(cache_dir)
+    out = {}
+    def open_array(name, dtype, size):
+        out[name] = datacache.open_array(tmp_dir, name, dtype, (size,))
+        return out[name]
+
+    for name, new in [('train_user', users), ('train_indices', items)]:
+        flat = open_array(name, ID_DTYPE, E_old + B)
+        for start in range(0, E_old, chunk):
+            end = min(start + chunk, E_old)
+            flat[start:end] = arrays[name][start:end]
+        flat[E_old:] = new
+
+    #user*m_item+item keys keep their order when m_item grows, items stay below m_old
+    keys = users * m_new + items
+    order = np.argsort(keys, kind='stable')
+    def edge_block(a, b):
+        old = np.asarray(arrays['edge_keys'][a:b])
+        old = old // m_old * m_new + old % m_old
+        return old, [old, arrays['edge_order'][a:b]]
+    datacache.merge_sorted([open_array('edge_keys', np.int64, E_old + B), open_array('edge_order', np.int64, E_old + B)],
+                           edge_block, E_old, [keys[order], E_old + order], keys[order], chunk)
+
+    #CSR of the distinct items of every user and CSC of the users of every item, the new pairs are distinct from the old ones
+    for name, rows, cols, n_rows, n_cols, n_rows_old in [('pos', users, items, n_new, m_new, n_old), ('item', items, users, m_new, n_new, m_old)]:
+        indptr, indices = arrays[f'{name}_indptr'], arrays[f'{name}_indices']
+        keys = rows * n_cols + cols
+        order = np.argsort(keys)
+        def csr_block(a, b, indptr=indptr, indices=indices, n_cols=n_cols):
+            old_rows = np.searchsorted(indptr, np.arange(a, b), side='right') - 1
+            old_cols = np.asarray(indices[a:b])
+            return old_rows * n_cols + old_cols, [old_cols]
+        datacache.merge_sorted([open_array(f'{name}_indices', ID_DTYPE, len(indices) + B)], csr_block, len(indices),
+                               [cols[order]], keys[order], chunk)
+        degree = np.pad(np.diff(indptr), (0, n_rows - n_rows_old)) + np.bincount(rows, minlength=n_rows)
+        out[f'{name}_indptr'] = np.concatenate(([0], np.cumsum(degree)))
+        np.save(join(tmp_dir, f'{name}_indptr.npy'), out[f'{name}_indptr'])
+
+    for array in out.values():
+        if isinstance(array, np.memmap):
+            array.flush()
+    datacache.commit(tmp_dir, cache_dir, out, {'n_user': int(n_new), 'm_item': int(m_new), 'appended_edges': int(B)})
+    return datacache.load(cache_dir)[0]
+
+class IdMap():
+    """
+    Raw ids <-> dense ids 0..n-1 of a compacted dataset.\n
+    raw[dense] is the raw id (int64, or str for datasets converted from string tokens), raw ids are found through
+    a sorted copy in O(log n), unseen raw ids can be appended (add).
+    """
+    def __init__(self, raw):
+        self.raw = np.asarray(raw)
+        self._order = np.argsort(self.raw, kind='stable')
+        self._sorted = self.raw[self._order]
+
+    def __len__(self):
+        return len(self.raw)
+
+    def to_raw(self, dense):
+        return self.raw[np.asarray(dense)]
+
+    def _as_raw(self, raw):
+        return np.asarray(raw, dtype=np.int64) if self.raw.dtype.kind in 'iu' else np.asarray(raw, dtype=str)
+
+    def to_dense(self, raw):
+        '''
+        return: dense id of every raw id, -1 for raw ids never seen
+        '''
+        raw = self._as_raw(raw)
+        if len(self.raw) == 0:
+            return np.full(raw.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted, raw), len(self.raw) - 1)
+        return np.where(self._sorted[pos] == raw, self._order[pos], -1)
+
+    def add(self, raw):
+        '''
+        return: dense ids of raw, raw ids never seen get the next dense ids in order of first appearance
+        '''
+        raw = self._as_raw(raw)
+        new = raw[self.to_dense(raw) < 0]
+        _, first = np.unique(new, return_index=True)
+        new = new[np.sort(first)]
+        if len(new):
+            dense = np.arange(len(self.raw), len(self.raw) + len(new))
+            order = np.argsort(new, kind='stable')
+            pos = np.searchsorted(self._sorted, new[order])
+            self._sorted = np.insert(self._sorted.astype(np.result_type(self._sorted, new)), pos, new[order])
+            self._order = np.insert(self._order, pos, dense[order])
+            self.raw = np.concatenate((self.raw, new))
+        return self.to_dense(raw)
+
+class CSRView():
+    """
+    Read-only {row: array of cols} view over CSR indptr/indices.\n
+    view[row] is a zero-copy slice of indices, empty for rows without interaction.
+    """
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row+1]]
+
+    def batch(self, rows):
+        '''
+        neighbors of a batch of rows in one flat pair, no per-row Python work\n
+        return: (row_ids, col_ids), row_ids[k] is the position of the row in the batch
+        '''
+        rows = np.asarray(rows)
+        starts = self.indptr[rows]
+        lens = self.indptr[rows + 1] - starts
+        row_ids = np.repeat(np.arange(len(rows)), lens)
+        pos = np.arange(len(row_ids)) + np.repeat(starts - (np.cumsum(lens) - lens), lens)
+        return row_ids, self.indices[pos]
+
+class EdgeIndex():
+    """
+    Training edges as sorted user*m_item+item int64 keys.\n
+    Maps a batch of (user, item) pairs to edge ids (position in trainUser/trainItem) in O(B log E), no dense matrix.
+    """
+    def __init__(self, users, items, m_item):
+        self.m_item = m_item
+        keys = np.asarray(users, dtype=np.int64) * m_item + np.asarray(items, dtype=np.int64)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def insert(self, users, items, edge_ids, m_item=None):
+        '''
+        add edges in place by merging into the sorted keys (O(E), no re-sort), m_item widens the key space for new items
+        '''
+        if m_item is not None and m_item != self.m_item:
+            self.keys = self.keys // self.m_item * m_item + self.keys % self.m_item
+            self.m_item = m_item
+        keys = np.asarray(users, dtype=np.int64) * self.m_item + np.asarray(items, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        pos = np.searchsorted(self.keys, keys[order], side='right')
+        self.keys = np.insert(self.keys, pos, keys[order])
+        self.order = np.insert(self.order, pos, np.asarray(edge_ids, dtype=np.int64)[order])
+
+    @classmethod
+    def from_sorted(cls, keys, order, m_item):
+        '''
+        wrap keys already sorted with their edge ids, e.g. memory-mapped edge_keys/edge_order of the cache
+        '''
+        index = cls.__new__(cls)
+        index.m_item, index.keys, index.order = m_item, keys, order
+        return index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, users, items):
+        '''
+        return: edge id of every (user, item) pair, -1 means no edge between them
+        '''
+        keys = np.asarray(users, dtype=np.int64) * self.m_item + np.asarray(items, dtype=np.int64)
+        if len(self.keys) == 0:
+            return np.full(keys.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, self.order[pos], -1)
+
+    def is_edge(self, users, items):
+        keys = np.asarray(users, dtype=np.int64) * self.m_item + np.asarray(items, dtype=np.int64)
+        if len(self.keys) == 0:
+            return np.zeros(keys.shape, dtype=bool)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return self.keys[pos] == keys
+
+class GraphView():
+    """
+    Graph algorithms served straight from a symmetric scipy CSR adjacency.\n
+    Sparse matvecs are split into row blocks of equal nnz run by a thread pool (scipy releases the GIL inside them).
+    networkx is only an opt-in fallback (to_networkx), its graph costs several times the memory of the CSR matrix.
+    """
+    def __init__(self, adj, threads=None):
+        self.adj = adj.tocsr()
+        self._structure = None
+        self._transition = None
+        self.threads = threads or torch.get_num_threads()
+        self._blocks = {}
+        self._pool = None
+
+    @property
+    def num_nodes(self):
+        return self.adj.shape[0]
+
+    def degree(self):
+        '''
+        number of neighbors of every node
+        '''
+        return np.diff(self.adj.indptr)
+
+    def neighbors(self, node):
+        return self.adj.indices[self.adj.indptr[node]:self.adj.indptr[node+1]]
+
+    def row_blocks(self, mat):
+        '''
+        [(row0, row1, CSR of the rows)], self.threads blocks with about the same nnz, the blocks share the arrays of mat
+        '''
+        cuts = np.searchsorted(mat.indptr, np.linspace(0, mat.nnz, self.threads + 1)[1:-1])
+        cuts = np.unique(np.concatenate(([0], np.minimum(cuts, mat.shape[0]), [mat.shape[0]])))
+        blocks = []
+        for r0, r1 in zip(cuts[:-1], cuts[1:]):
+            e0, e1 = mat.indptr[r0], mat.indptr[r1]
+            blocks.append((r0, r1, sp.csr_matrix((mat.data[e0:e1], mat.indices[e0:e1], mat.indptr[r0:r1+1] - e0), shape=(r1 - r0, mat.shape[1]))))
+        return blocks
+
+    def matvec(self, x, weighted=True):
+        '''
+        A @ x, with the edge weights or with every edge counted as 1
+        '''
+        if not weighted and self._structure is None:
+            self._structure = sp.csr_matrix((np.ones(self.adj.nnz, dtype=np.float32), self.adj.indices, self.adj.indptr), shape=self.adj.shape)
+        mat = self.adj if weighted else self._structure
+        if self.threads <= 1 or mat.nnz < PARALLEL_NNZ:
+            return mat @ x
+        if weighted not in self._blocks:
+            self._blocks[weighted] = self.row_blocks(mat)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.threads)
+        out = np.empty(mat.shape[0], dtype=np.result_type(mat.dtype, x.dtype))
+        def run(block):
+            r0, r1, rows = block
+            out[r0:r1] = rows @ x
+        list(self._pool.map(run, self._blocks[weighted]))
+        return out
+
+    def eigenvector_centrality(self, max_iter=100, tol=1e-04, weighted=False, x0=None):
+        '''
+        Same power iteration as nx.eigenvector_centrality (unweighted by default, like networkx):\n
+        x <- (A + I) @ x / ||(A + I) @ x|| from x0 (warm start) or 1/n, stop when ||x - x_last||_1 < num_nodes * tol\n
+        return: (x, number of iterations, ||x - x_last||_1 / num_nodes of the last iteration),
+        RuntimeError if it did not converge in max_iter iterations
+        '''
+        n = self.num_nodes
+        x = np.full(n, 1. / n) if x0 is None else np.array(x0, dtype=np.float64)
+        err = np.inf
+        for i in range(1, max_iter + 1):
+            x_last = x
+            x = x_last + self.matvec(x_last, weighted=weighted)
+            x = x / (np.linalg.norm(x) or 1.)
+            err = np.abs(x - x_last).sum() / max(n, 1)
+            if err < tol:
+                return x, i, err
+        raise RuntimeError(f'eigenvector centrality did not converge in {max_iter} iterations (residual {err:.2e}, tol {tol:.0e})')
+
+    def pagerank(self, damp=0.85, max_iter=100, tol=1e-06, x0=None):
+        '''
+        x <- (1 - damp) * x + damp * A @ D^(-1) @ x over the unweighted adjacency, one sparse matvec per iteration,
+        from x0 (warm start) or all ones. Stop when ||x - x_last||_1 < num_nodes * tol or after max_iter iterations.\n
+        return: (x, number of iterations, ||x - x_last||_1 / num_nodes of the last iteration)
+        '''
+        n = self.num_nodes
+        degree = self.degree()
+        inv_degree = np.divide(1., degree, out=np.zeros(n), where=degree > 0)
+        x = np.ones(n) if x0 is None else np.array(x0, dtype=np.float64)
+        err = np.inf
+        for i in range(1, max_iter + 1):
+            x_last = x
+            x = (1 - damp) * x_last + damp * self.matvec(x_last * inv_degree, weighted=False)
+            err = np.abs(x - x_last).sum() / max(n, 1)
+            if err < tol:
+                break
+        return x, i, err
+
+    def local_sweeps(self, x, seeds, update, tol=1e-06, max_iter=50, max_active=0.1):
+        '''
+        Jacobi sweeps on the nodes around seeds only, e.g. the nodes touched by new edges on top of a previous solution:\n
+        update(active, rows, x) returns the new x[active] from rows, the CSR slice of their neighbors.
+        Nodes that moved by more than tol activate their neighbors for the next sweep, the others are left alone.
+        Stops when nothing moves any more or when more than max_active of the nodes are active: the correction is no longer
+        local and a global iteration (one matvec) is cheaper than slicing the CSR.\n
+        return: (x, number of sweeps, number of node updates)
+        '''
+        x = np.array(x, dtype=np.float64)
+        active = np.unique(seeds)
+        n_sweep, work = 0, 0
+        while len(active) and n_sweep < max_iter and len(active) <= max_active * self.num_nodes:
+            n_sweep += 1
+            rows = self.adj[active]
+            new = update(active, rows, x)
+            moved = active[np.abs(new - x[active]) > tol]
+            x[active] = new
+            work += len(active)
+            active = np.unique(np.concatenate((moved, self.adj[moved].indices)))
+        return x, n_sweep, work
+
+    @staticmethod
+    def _neighbor_sum(rows, values):
+        '''
+        sum of values over the neighbors of every row of the CSR slice rows
+        '''
+        return np.bincount(np.repeat(np.arange(rows.shape[0]), np.diff(rows.indptr)), weights=values[rows.indices], minlength=rows.shape[0])
+
+    def eigenvector_sweeps(self, x, seeds, tol=1e-04, max_iter=50):
+        '''
+        local_sweeps with the update of eigenvector_centrality: x_v <- ((A + I) @ x)_v / mu, mu the Rayleigh quotient of x,
+        then x is normalized again (unweighted, like eigenvector_centrality)
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        mu = x @ (x + self.matvec(x, weighted=False)) / (x @ x)
+        def update(active, rows, x):
+            return (x[active] + self._neighbor_sum(rows, x)) / mu
+        x, n_sweep, work = self.local_sweeps(x, seeds, update, tol=tol, max_iter=max_iter)
+        return x / (np.linalg.norm(x) or 1.), n_sweep, work
+
+    def personalized_pagerank(self, sources, alpha=0.15, eps=1e-04):
+        '''
+        approximate personalized PageRank from every node of sources by forward push (Andersen, Chung and Lang, 2006)
+        over the unweighted adjacency: p += alpha * r_v, r_w += (1 - alpha) * r_v / deg(v) for the neighbors w of v, r_v = 0,
+        until every residual r_v < eps * deg(v). All nodes above the threshold are pushed in the same round
+        for all sources at once (sparse products), the pushed mass per source is at most 1 / (alpha * eps) edges whatever the graph size.\n
+        return: (P, number of rounds), P a CSR (len(sources), num_nodes), row k approximates the PPR vector of sources[k]
+        '''
+        degree = self.degree()
+        if self._transition is None:#D^(-1) @ A
+            self._transition = sp.csr_matrix((np.repeat(np.divide(1., degree, out=np.zeros(self.num_nodes), where=degree > 0), degree),
+                                              self.adj.indices, self.adj.indptr), shape=self.adj.shape)
+        threshold = eps * degree
+        sources = np.asarray(sources)
+        R = sp.csr_matrix((np.ones(len(sources)), (np.arange(len(sources)), sources)), shape=(len(sources), self.num_nodes))
+        P = sp.csr_matrix(R.shape)
+        n_round = 0
+        while True:
+            push = R.data >= threshold[R.indices]
+            if not push.any():
+                break
+            n_round += 1
+            pushed = R.copy()
+            pushed.data[~push] = 0
+            pushed.eliminate_zeros()
+            R.data[push] = 0
+            R.eliminate_zeros()
+            P = P + alpha * pushed
+            R = R + (1 - alpha) * (pushed @ self._transition)
+        return P, n_round
+
+    def to_networkx(self):
+        import networkx as nx
+        if hasattr(nx, 'from_scipy_sparse_array'):
+            return nx.from_scipy_sparse_array(self.adj)
+        return nx.from_scipy_sparse_matrix(self.adj)
+
 class dataset():
     """
     Dataset type for pytorch \n
@@ -31,123 +719,105 @@ class dataset():
     def __init__(self, config = world.config, path="../data/yelp2018"):
         # train or test
         print(f'loading [{path}]')
-        self.n_user = 0
-        self.m_item = 0
         if config['if_valid']:
             train_file = path + '/train_7.txt'
-            valid_file = path + '/valid_1.txt' #TODO 为了正确统计数据集  后面的程序会受到“未见过test数据集”这一变化的影响
+            valid_file = path + '/valid_1.txt' #pre-made split, if missing it is built from train.txt below
             test_file = path + '/test.txt'
         else:
             train_file = path + '/train.txt'
             valid_file = path + '/valid.txt'
             test_file = path + '/test.txt'
         self.path = path
-        trainUniqueUsers, trainItem, trainUser = [], [], []
-        testUniqueUsers, testItem, testUser = [], [], []
-        validUniqueUsers, validItem, validUser = [], [], []
-        self.traindataSize = 0
-        self.testDataSize = 0
         self.validDataSize = 0
+        self.out_of_core = config['out_of_core']
+        compact = config['compact_ids']
+        #no pre-made train_7.txt/valid_1.txt: hold out part of train.txt per user, see split_arrays
+        self.split_valid = bool(config['if_valid']) and not os.path.exists(train_file)
+        if self.split_valid:
+            train_file, valid_file = path + '/train.txt', path + '/valid.txt'
 
-        self._TrainPop_item = {}#item's popularity (degree) in the training dataset
-        self._TrainPop_user = {}#user's popularity (degree) in the training dataset
-        
-        self._allPos = {}
-        self._allPos_item = {}
-
-        with open(train_file) as f:
-            for l in f.readlines():
-                if len(l) > 0:
-                    l = l.strip('\n').split(' ')
-                    items = [int(i) for i in l[1:]]
-                    uid = int(l[0])
-                    trainUniqueUsers.append(uid)
-                    trainUser.extend([uid] * len(items))
-                    trainItem.extend(items)
-                    self.m_item = max(self.m_item, max(items))
-                    self.n_user = max(self.n_user, uid)
-                    self.traindataSize += len(items)
-                    #================Pop=================#
-                    for item in items:
-                        if item in self._TrainPop_item.keys():
-                            self._TrainPop_item[item] += 1
-                        else:
-                            self._TrainPop_item[item] = 1
-                        
-                        if item in self._allPos_item.keys():
-                            self._allPos_item[item].append(uid)
-                        else:
-                            self._allPos_item[item] = [uid]
-
-                    if uid in self._TrainPop_user.keys():
-                        self._TrainPop_user[uid] += len(items)
-                    else:
-                        self._TrainPop_user[uid] = len(items)
-
-                    self._allPos[uid] = items
-                    #================Pop=================#
-        self.trainUniqueUsers = np.array(trainUniqueUsers)
-        self.trainUser = np.array(trainUser)
-        self.trainItem = np.array(trainItem)
-
-        with open(test_file) as f:
-            for l in f.readlines():
-                if len(l) > 0:
-                    l = l.strip('\n').split(' ')
-                    if l[1]:
-                        items = [int(i) for i in l[1:]]
-                        uid = int(l[0])
-                        testUniqueUsers.append(uid)
-                        testUser.extend([uid] * len(items))
-                        testItem.extend(items)
-                        self.m_item = max(self.m_item, max(items))
-                        self.n_user = max(self.n_user, uid)
-                        self.testDataSize += len(items)
-        self.testUniqueUsers = np.array(testUniqueUsers)
-        self.testUser = np.array(testUser)
-        self.testItem = np.array(testItem)
-        
-        
-        if os.path.exists(valid_file):
-            with open(valid_file) as f:
-                for l in f.readlines():
-                    if len(l) > 0:
-                        l = l.strip('\n').split(' ')
-                        if l[1]:
-                            items = [int(i) for i in l[1:]]
-                            uid = int(l[0])
-                            validUniqueUsers.append(uid)
-                            validUser.extend([uid] * len(items))
-                            validItem.extend(items)
-                            self.m_item = max(self.m_item, max(items))
-                            self.n_user = max(self.n_user, uid)
-                            self.validDataSize += len(items)
-            self.validUniqueUsers = np.array(validUniqueUsers)
-            self.validUser = np.array(validUser)
-            self.validItem = np.array(validItem)
-        
-        self.m_item += 1
-        self.n_user += 1
-        
-        #TODO 补全（在没划分valid的train.txt中全部的item都出现过了？？？——这样的数据集是怎样划分的？我直接随机把train拆出来valid是不是不妥？？？？）
-        for i in range(self.m_item):
-            if i not in self._TrainPop_item.keys():
-                # self._TrainPop_item[i] = 0
-                self._TrainPop_item[i] = 1 #如果“在没划分valid的train.txt中全部的item都出现过了”，那在train_7.txt中没出现的，应该在train.txt中至少有1的热度
+        if not os.path.exists(train_file) and os.path.exists(join(path, CONVERTED_FILE)):
+            #no text files, the binary cache was written by convert.py
+            with open(join(path, CONVERTED_FILE)) as f:
+                converted = json.load(f)
+            self.split_valid = self.split_valid and not converted['valid']
+            self.source_hash = converted['cache']
+            cache_dir, cache = self._cached_arrays(self.source_hash, list(converted['files'].values()), None, None)
+        else:
+            #binary cache keyed by the content of the source files and the split, see datacache.py
+            source_files = [train_file, test_file] + ([valid_file] if os.path.exists(valid_file) else [])
+            self.source_hash = datacache.source_hash(source_files, int(config['if_valid'] and not self.split_valid), compact)
+            cache_dir, cache = self._cached_arrays(self.source_hash, source_files,
+                                                   lambda: build_arrays(train_file, test_file, valid_file, compact=compact),
+                                                   lambda cache_dir: stream_build_arrays(train_file, test_file, valid_file, cache_dir, compact=compact))
+        if self.split_valid:
+            #derived from the if_valid=0 cache, the text files are not parsed again.
+            #source_hash now names the split: precalculated matrices keyed by it are never shared with the unsplit train set
+            arrays, meta = cache
+            seed = config['seed']
+            self.source_hash = datacache.chain_hash(self.source_hash, np.array([seed]), np.array([VALID_RATIO]))
+            cache_dir, cache = self._cached_arrays(self.source_hash, [f'train.txt holdout (seed {seed})'],
+                                                   lambda: split_arrays(arrays, meta, seed),
+                                                   lambda cache_dir: write_split_arrays(arrays, meta, seed, cache_dir))
+        arrays, meta = cache
+        self.n_user = meta['n_user']
+        self.m_item = meta['m_item']
+        if self.out_of_core:
+            arrays = build_out_of_core_arrays(cache_dir, arrays, meta)
+        #raw ids of a compacted dataset, see to_raw_users/to_raw_items
+        self.user_map = IdMap(arrays['raw_user_ids']) if 'raw_user_ids' in arrays else None
+        self.item_map = IdMap(arrays['raw_item_ids']) if 'raw_item_ids' in arrays else None
+
+        train_indptr = arrays['train_indptr']
+        self.trainItem = arrays['train_indices']
+        if 'train_user' in arrays:
+            self.trainUser = arrays['train_user']
+        else:
+            self.trainUser = np.repeat(np.arange(self.n_user, dtype=ID_DTYPE), np.diff(train_indptr))
+        self.trainUniqueUsers = np.flatnonzero(np.diff(train_indptr))
+        self.traindataSize = len(self.trainItem)
 
+        self.testUser, self.testItem, self.testUniqueUsers = arrays['test_user'], arrays['test_item'], arrays['test_unique_users']
+        self.testDataSize = len(self.testItem)
+        if 'valid_user' in arrays:
+            self.validUser, self.validItem, self.validUniqueUsers = arrays['valid_user'], arrays['valid_item'], arrays['valid_unique_users']
+            self.validDataSize = len(self.validItem)
 
+        #================Pop=================#
+        self.item_degree = chunked_bincount(self.trainItem, self.m_item)
+        self.user_degree = np.diff(train_indptr)
+        #keep the order in which items/users first appear in train.txt, ties in Pop are broken by it
+        self._TrainPop_item = dict(zip(*_first_seen(self.trainItem, self.item_degree)))#item's popularity (degree) in the training dataset
+        self._TrainPop_user = dict(zip(*_first_seen(self.trainUser, self.user_degree)))#user's popularity (degree) in the training dataset
+        #items without training interaction (seen only in test/valid, e.g. held out by split_arrays) get popularity 1.
+        #split_arrays keeps at least one interaction per user in train, its holdout is seeded so the split and the caches
+        #keyed by source_hash (chained with the seed) are reproducible. With compact_ids there are no id gaps left here
+        self._TrainPop_item.update(dict.fromkeys(np.flatnonzero(self.item_degree == 0).tolist(), 1))
+        #================Pop=================#
 
         self.Graph = None
+        self.norm_adj = None
+        self._graph_view = None
+        self._edge_lookup = None
         print(f"{self.n_user} users and {self.m_item} items")
         print(f"{self.trainDataSize} interactions for training")
         print(f"{self.testDataSize} interactions for testing")
         print(f"{config['dataset']} Sparsity : {(self.trainDataSize + self.testDataSize) / self.n_users / self.m_items}")#针对无验证集时的稀疏度计算公式
 
-        # (users,items), bipartite graph
-        self.UserItemNet = csr_matrix((np.ones(len(self.trainUser)), (self.trainUser, self.trainItem)), shape=(self.n_user, self.m_item))
         # pre-calculate
-        # self._allPos = self.getUserPosItems(list(range(self.n_user)))
-        # self._allPos_item = self.getItemPosUsers(list(range(self.m_item)))
+        #CSR (users' items) and CSC (items' users) views instead of dicts of lists, cheap to pickle into DataLoader workers
+        if self.out_of_core:
+            #no scipy matrix: it would copy the indices into memory, the views read the memory-mapped cache on demand
+            self.UserItemNet = None
+            self._allPos = CSRView(arrays['pos_indptr'], arrays['pos_indices'])
+            self._allPos_item = CSRView(arrays['item_indptr'], arrays['item_indices'])
+            self._edge_lookup = EdgeIndex.from_sorted(arrays['edge_keys'], arrays['edge_order'], self.m_item)
+        else:
+            # (users,items), bipartite graph
+            self.UserItemNet = csr_matrix((np.ones(len(self.trainUser), dtype=bool), (self.trainUser, self.trainItem)), shape=(self.n_user, self.m_item))
+            self._allPos = CSRView(self.UserItemNet.indptr, self.UserItemNet.indices)
+            UserItemNet_csc = self.UserItemNet.tocsc()
+            self._allPos_item = CSRView(UserItemNet_csc.indptr, UserItemNet_csc.indices)
         self.__testDict = self.__build_test()
         if world.config['if_valid']:
             self.__validDict = self.__build_valid()
@@ -158,6 +828,35 @@ class dataset():
 
         print(f"{config['dataset']} is ready to go")
 
+    def _cached_arrays(self, cache_key, sources, build, stream):
+        '''
+        binary cache cache_key of this dataset, on a miss it is made by build() (in memory, then saved)
+        or by stream(cache_dir) in out-of-core mode, build None means it can only be loaded (convert.py caches)\n
+        return: (cache_dir, (arrays, meta))
+        '''
+        cache_dir = join(self.path, 'cache', cache_key)
+        cache = datacache.load(cache_dir)
+        names = [os.path.basename(source) for source in sources]
+        if cache is not None:
+            print(f'loading binary cache from {cache_dir}')
+        elif build is None:
+            raise FileNotFoundError(f'binary cache {cache_dir} of {names} is missing, run convert.py again')
+        elif self.out_of_core:
+            print(f'streaming {names} into {cache_dir}')
+            stream(cache_dir)
+            cache = datacache.load(cache_dir)
+        else:
+            print(f'parsing {names}')
+            arrays, meta = build()
+            try:
+                datacache.save(cache_dir, arrays, meta)
+                cache = datacache.load(cache_dir)
+                print(f'saved binary cache to {cache_dir}')
+            except OSError as e:
+                print(f'binary cache not saved: {e}')
+                cache = arrays, meta
+        return cache_dir, cache
+
     @property
     def n_users(self):
         return self.n_user
@@ -188,10 +887,16 @@ class dataset():
 
     @property
     def allPos(self):
+        '''
+        CSRView, allPos[user] = items of user in training set
+        '''
         return self._allPos
     
     @property
     def allPos_item(self):
+        '''
+        CSRView, allPos_item[item] = users of item in training set
+        '''
         return self._allPos_item
 
     @property
@@ -208,6 +913,33 @@ class dataset():
         '''
         return self._TrainPop_user
     
+    @property
+    def edge_lookup(self):
+        '''
+        EdgeIndex of the training edges, built on first use
+        '''
+        if self._edge_lookup is None:
+            self._edge_lookup = EdgeIndex(self.trainUser, self.trainItem, self.m_item)
+        return self._edge_lookup
+
+    def is_edge(self, users, items):
+        '''
+        whether (user, item) pairs are training interactions, scalars or arrays
+        '''
+        return self.edge_lookup.is_edge(users, items)
+
+    def to_raw_users(self, users):
+        '''
+        raw ids (as in the text files) of dense user ids, for evaluation output and export
+        '''
+        return self.user_map.to_raw(users) if self.user_map is not None else np.asarray(users)
+
+    def to_raw_items(self, items):
+        '''
+        raw ids (as in the text files) of dense item ids, for evaluation output and export
+        '''
+        return self.item_map.to_raw(items) if self.item_map is not None else np.asarray(items)
+
     @property
     def edge_indices(self):
         '''
@@ -221,21 +953,208 @@ class dataset():
         '''
         graph: (n_user+n_item) * (n_user+n_item)
         '''
-        self.edge_index = torch.LongTensor([list(np.append(self.trainUser, self.trainItem+self.n_user)), 
-                                        list(np.append(self.trainItem+self.n_user, self.trainUser))]).to(world.device)
+        #filled slice by slice: no Python lists and no full host copy of (memory-mapped) trainUser/trainItem
+        #ids are widened to int64 here, PyG message passing needs a long edge_index
+        E = len(self.trainUser)
+        self.edge_index = torch.empty((2, 2*E), dtype=torch.long, device=world.device)
+        for start in range(0, E, CHUNK_EDGES):
+            end = min(start + CHUNK_EDGES, E)
+            users = torch.from_numpy(np.asarray(self.trainUser[start:end], dtype=np.int64)).to(world.device)
+            items = torch.from_numpy(np.asarray(self.trainItem[start:end], dtype=np.int64)).to(world.device) + self.n_user
+            self.edge_index[0, start:end], self.edge_index[0, E+start:E+end] = users, items
+            self.edge_index[1, start:end], self.edge_index[1, E+start:E+end] = items, users
         self.graph_pyg = Data(edge_index=self.edge_index.contiguous())
         return self.edge_index
 
+    def add_interactions(self, users, items, raw_ids=False):
+        """
+        Append new training interactions (users[k], items[k]) without rebuilding the dataset.\n
+        Ids beyond n_users/m_items grow the graph. Pairs already in the training set (or repeated) are skipped,
+        new edges get the ids trainDataSize, trainDataSize+1, ... so existing edge ids stay valid.\n
+        Degrees, Pop dicts, CSR views, edge lookup, edge_index/graph_pyg and the normalized adjacency are updated in place,
+        source_hash changes so that caches keyed by it are not reused. Models keep the graph and embeddings they were built with.
+        In out-of-core mode the memory-mapped arrays are merged with the new edges into a new cache generation
+        (append_out_of_core_arrays, one streamed pass over them), better call it with large batches there.\n
+        raw_ids: users/items are raw ids of a compacted dataset, unseen ones get new dense ids (see IdMap.add)\n
+        return: (changed_users, changed_items), dense ids of the nodes that got new edges
+        """
+        n_old, m_old, E_old = self.n_user, self.m_item, self.trainDataSize
+        if raw_ids and self.user_map is not None:
+            users, items = self.user_map.add(np.ravel(users)), self.item_map.add(np.ravel(items))
+        users = np.asarray(users, dtype=np.int64).reshape(-1)
+        items = np.asarray(items, dtype=np.int64).reshape(-1)
+        if not raw_ids and self.user_map is not None and ((users >= n_old).any() or (items >= m_old).any()):
+            raise ValueError('new users/items of a compacted dataset must be given as raw ids (raw_ids=True)')
+        n_new = max(n_old, int(users.max()) + 1) if len(users) else n_old
+        m_new = max(m_old, int(items.max()) + 1) if len(items) else m_old
+        _, first = np.unique(users * m_new + items, return_index=True)
+        users, items = users[np.sort(first)], items[np.sort(first)]
+        known = (users < n_old) & (items < m_old)
+        keep = np.ones(len(users), dtype=bool)
+        keep[known] = ~self.is_edge(users[known], items[known])
+        users, items = users[keep], items[keep]
+        edge_ids = np.arange(E_old, E_old + len(users))
+
+        self.source_hash = datacache.chain_hash(self.source_hash, users, items)
+        if self.out_of_core:
+            arrays = {'train_user': self.trainUser, 'train_indices': self.trainItem,
+                      'edge_keys': self._edge_lookup.keys, 'edge_order': self._edge_lookup.order,
+                      'pos_indptr': self._allPos.indptr, 'pos_indices': self._allPos.indices,
+                      'item_indptr': self._allPos_item.indptr, 'item_indices': self._allPos_item.indices}
+            arrays = append_out_of_core_arrays(join(self.path, 'cache', self.source_hash), arrays, n_old, m_old, users, items, n_new, m_new)
+            self.trainUser, self.trainItem = arrays['train_user'], arrays['train_indices']
+        else:
+            self.trainUser = np.concatenate((self.trainUser, users.astype(ID_DTYPE)))
+            self.trainItem = np.concatenate((self.trainItem, items.astype(ID_DTYPE)))
+        self.traindataSize = len(self.trainItem)
+        self.n_user, self.m_item = n_new, m_new
+
+        #degrees and Pop, unseen ids enter the dicts in order of first appearance as in __init__
+        user_degree_old = np.pad(self.user_degree, (0, n_new - n_old))
+        item_degree_old = np.pad(self.item_degree, (0, m_new - m_old))
+        self.user_degree = user_degree_old + np.bincount(users, minlength=n_new)
+        self.item_degree = item_degree_old + np.bincount(items, minlength=m_new)
+        self.trainUniqueUsers = np.flatnonzero(self.user_degree)
+        self._TrainPop_user.update(zip(*_first_seen(users, self.user_degree)))
+        self._TrainPop_item.update(zip(*_first_seen(items, self.item_degree)))
+        self._TrainPop_item.update(dict.fromkeys((np.flatnonzero(self.item_degree[m_old:] == 0) + m_old).tolist(), 1))
+
+        #CSR/CSC, the views are updated in place so that samplers holding them see the new edges
+        if self.out_of_core:
+            self._allPos.indptr, self._allPos.indices = arrays['pos_indptr'], arrays['pos_indices']
+            self._allPos_item.indptr, self._allPos_item.indices = arrays['item_indptr'], arrays['item_indices']
+            self._edge_lookup = EdgeIndex.from_sorted(arrays['edge_keys'], arrays['edge_order'], m_new)
+        else:
+            self.UserItemNet.resize((n_new, m_new))
+            self.UserItemNet = self.UserItemNet + csr_matrix((np.ones(len(users), dtype=bool), (users, items)), shape=(n_new, m_new))
+            self._allPos.indptr, self._allPos.indices = self.UserItemNet.indptr, self.UserItemNet.indices
+            UserItemNet_csc = self.UserItemNet.tocsc()
+            self._allPos_item.indptr, self._allPos_item.indices = UserItemNet_csc.indptr, UserItemNet_csc.indices
+            if self._edge_lookup is not None:
+                self._edge_lookup.insert(users, items, edge_ids, m_new)
+
+        #edge_index keeps its layout [user->item edges, item->user edges], item nodes move behind the new users
+        u = torch.from_numpy(users).to(world.device)
+        i = torch.from_numpy(items).to(world.device) + n_new
+        edge_index = torch.where(self.edge_index >= n_old, self.edge_index + (n_new - n_old), self.edge_index)
+        self.edge_index = torch.cat([edge_index[:, :E_old], torch.stack([u, i]), edge_index[:, E_old:], torch.stack([i, u])], dim=1)
+        self.graph_pyg = Data(edge_index=self.edge_index.contiguous())
+
+        if self.norm_adj is not None:
+            self.norm_adj = self._grow_norm_adj(self.norm_adj, n_old, m_old, user_degree_old, item_degree_old, users, items)
+        self.Graph = None
+        self._graph_view = None
+        return np.unique(users), np.unique(items)
+
+    def _grow_norm_adj(self, norm_adj, n_old, m_old, user_degree_old, item_degree_old, users, items):
+        '''
+        D^(-1/2) @ A @ D^(-1/2) after add_interactions, from the old matrix instead of all edges:\n
+        empty rows/cols are inserted for the new nodes, old weights are rescaled with sqrt(old degree / new degree)
+        of both ends and the new edges are added with their new weights.
+        '''
+        n_new, m_new = self.n_user, self.m_item
+        num_nodes = n_new + m_new
+        adj = norm_adj.tocsr()
+        shift = n_new - n_old
+        indptr = np.concatenate((adj.indptr[:n_old+1], np.full(shift, adj.indptr[n_old]),
+                                 adj.indptr[n_old+1:], np.full(m_new - m_old, adj.indptr[-1])))
+        indices = np.where(adj.indices >= n_old, adj.indices + shift, adj.indices)
+        degree_old = np.concatenate((user_degree_old, item_degree_old)).astype(np.float32)
+        degree = np.concatenate((self.user_degree, self.item_degree)).astype(np.float32)
+        scale = np.ones(num_nodes, dtype=np.float32)
+        scale[degree_old > 0] = np.sqrt(degree_old[degree_old > 0] / degree[degree_old > 0])
+        rows = np.repeat(np.arange(num_nodes), np.diff(indptr))
+        adj = sp.csr_matrix((adj.data * scale[rows] * scale[indices], indices, indptr), shape=(num_nodes, num_nodes))
+
+        d_inv = np.zeros_like(degree)
+        d_inv[degree > 0] = np.power(degree[degree > 0], -0.5)
+        rows = np.concatenate((users, items + n_new))
+        cols = np.concatenate((items + n_new, users))
+        return adj + sp.csr_matrix((d_inv[rows] * d_inv[cols], (rows, cols)), shape=(num_nodes, num_nodes))
+
 
 
     def _convert_sp_mat_to_sp_tensor(self, X):
         coo = X.tocoo().astype(np.float32)
-        row = torch.Tensor(coo.row).long()
-        col = torch.Tensor(coo.col).long()
-        index = torch.stack([row, col])
-        data = torch.FloatTensor(coo.data)
-        return torch.sparse.FloatTensor(index, data, torch.Size(coo.shape))
+        index = torch.from_numpy(np.vstack((coo.row, coo.col)).astype(np.int64))
+        data = torch.from_numpy(coo.data)
+        return torch.sparse_coo_tensor(index, data, torch.Size(coo.shape))
         
+    def build_norm_adj(self):
+        """
+        D^(-1/2) @ A @ D^(-1/2) as CSR, built edge by edge from trainUser/trainItem:\n
+        the symmetric COO of the bipartite graph is scaled with 1/sqrt(|u|) * 1/sqrt(|i|) from the degree array,
+        so peak memory is linear in the number of edges (no DOK/LIL stage).
+        """
+        num_nodes = self.n_users + self.m_items
+        rows = np.concatenate((self.trainUser, self.trainItem + self.n_users))
+        cols = np.concatenate((self.trainItem + self.n_users, self.trainUser))
+        degree = np.bincount(rows, minlength=num_nodes).astype(np.float32)
+        d_inv = np.zeros_like(degree)
+        d_inv[degree > 0] = np.power(degree[degree > 0], -0.5)
+        vals = d_inv[rows] * d_inv[cols]
+        #duplicated interactions are summed, as they were in UserItemNet
+        return sp.csr_matrix((vals, (rows, cols)), shape=(num_nodes, num_nodes))
+
+    def adj_mat_meta(self):
+        '''
+        what s_pre_adj_mat.npz was built from, a cached matrix is only used if this matches
+        '''
+        return {'version': ADJ_MAT_VERSION,
+                'source_hash': self.source_hash,
+                'n_users': self.n_users,
+                'm_items': self.m_items,
+                'num_edges': self.trainDataSize,
+                'norm': 'D^(-1/2) @ A @ D^(-1/2)'}
+
+    def load_adj_mat(self, adj_mat_file):
+        '''
+        return: the cached normalized adjacency, or None if it is missing or does not match adj_mat_meta()
+        '''
+        try:
+            with open(adj_mat_file + '.json') as f:
+                meta = json.load(f)
+            norm_adj = sp.load_npz(adj_mat_file)
+        except (OSError, ValueError):
+            return None
+        num_nodes = self.n_users + self.m_items
+        if any(meta.get(key) != val for key, val in self.adj_mat_meta().items()) or norm_adj.shape != (num_nodes, num_nodes) or norm_adj.nnz != meta['nnz']:
+            cprint(f'{adj_mat_file} does not match the current data, rebuilding it')
+            return None
+        print("successfully loaded...")
+        return norm_adj
+
+    def save_adj_mat(self, adj_mat_file, norm_adj):
+        sp.save_npz(adj_mat_file, norm_adj)
+        with open(adj_mat_file + '.json', 'w') as f:
+            json.dump(dict(self.adj_mat_meta(), nnz=norm_adj.nnz), f)
+
+    def getNormAdj(self):
+        '''
+        scipy CSR of D^(-1/2) @ A @ D^(-1/2), loaded from s_pre_adj_mat.npz or built once
+        '''
+        if self.norm_adj is None:
+            adj_mat_file = self.path + '/s_pre_adj_mat.npz'
+            norm_adj = self.load_adj_mat(adj_mat_file)
+            if norm_adj is None:
+                print("generating adjacency matrix --- All train data")
+                s = time()
+                norm_adj = self.build_norm_adj()
+                end = time()
+                print(f"costing {end-s}s, saved norm_mat...")
+                self.save_adj_mat(adj_mat_file, norm_adj)
+            self.norm_adj = norm_adj
+        return self.norm_adj
+
+    @property
+    def graph_view(self):
+        '''
+        GraphView over the normalized adjacency, for centrality and other graph algorithms
+        '''
+        if self._graph_view is None:
+            self._graph_view = GraphView(self.getNormAdj())
+        return self._graph_view
+
     def getSparseGraph(self):
         """
         Graph = \n
@@ -247,50 +1166,9 @@ class dataset():
         """
         print("loading adjacency matrix")
         if self.Graph is None:
-            try:
-                pre_adj_mat = sp.load_npz(self.path + '/s_pre_adj_mat.npz')
-                print("successfully loaded...")
-                cprint('Remember to delete this pre-calculed mat while changing data split !')
-                norm_adj = pre_adj_mat
-            except :
-                print("generating adjacency matrix --- All train data")
-                s = time()
-                adj_mat = sp.dok_matrix((self.n_users + self.m_items, self.n_users + self.m_items), dtype=np.float32)
-                adj_mat = adj_mat.tolil()
-                # R = self.UserItemNet.tolil()
-                #此处会显存爆炸
-                # adj_mat[:self.n_users, self.n_users:] = R
-                # adj_mat[self.n_users:, :self.n_users] = R.T
-                # adj_mat = adj_mat.todok()
-                # adj_mat = adj_mat + sp.eye(adj_mat.shape[0]) TODO 无自连接
-                # 逐步构建邻接矩阵
-                batch_size = 30000  # 每次处理的批大小
-                num_batches = int(np.ceil(self.n_users / batch_size))
-
-                for batch_idx in range(num_batches):
-                    start_idx = batch_idx * batch_size
-                    end_idx = min((batch_idx + 1) * batch_size, self.n_users)
-                    # 构建用户部分的邻接矩阵
-                    batch_R = self.UserItemNet[start_idx:end_idx].tolil()
-                    adj_mat[start_idx:end_idx, self.n_users:] = batch_R
-                    adj_mat[self.n_users:, start_idx:end_idx] = batch_R.T
-
-                adj_mat = adj_mat.todok()
-
-                rowsum = np.array(adj_mat.sum(axis=1))#度
-                d_inv = np.power(rowsum, -0.5).flatten()
-                d_inv[np.isinf(d_inv)] = 0.
-                d_mat = sp.diags(d_inv)#对角阵
-                
-                norm_adj = d_mat.dot(adj_mat)
-                norm_adj = norm_adj.dot(d_mat)
-                norm_adj = norm_adj.tocsr()
-                end = time()
-                print(f"costing {end-s}s, saved norm_mat...")
-                sp.save_npz(self.path + '/s_pre_adj_mat.npz', norm_adj)
+            norm_adj = self.getNormAdj()
             self.Graph = self._convert_sp_mat_to_sp_tensor(norm_adj)
             self.Graph = self.Graph.coalesce().to(world.device)
-            self.nx_Graph = nx.from_scipy_sparse_matrix(norm_adj)#TODO 在dataset中用额外的nx_Graph存储networkx格式有点浪费内存！
         return self.Graph
 
     def __build_test(self):
@@ -298,28 +1176,14 @@ class dataset():
         return:
             dict: {user: [items]}
         """
-        test_data = {}
-        for i, item in enumerate(self.testItem):
-            user = self.testUser[i]
-            if test_data.get(user):
-                test_data[user].append(item)
-            else:
-                test_data[user] = [item]
-        return test_data
+        return group_by(self.testUser, self.testItem)
     
     def __build_valid(self):
         """
         return:
             dict: {user: [items]}
         """
-        valid_data = {}
-        for i, item in enumerate(self.validItem):
-            user = self.validUser[i]
-            if valid_data.get(user):
-                valid_data[user].append(item)
-            else:
-                valid_data[user] = [item]
-        return valid_data
+        return group_by(self.validUser, self.validItem)
 
     def getUserItemFeedback(self, users, items):
         """
@@ -330,20 +1194,25 @@ class dataset():
         return:
             feedback [-1]
         """
-        # print(self.UserItemNet[users, items])
-        return np.array(self.UserItemNet[users, items]).astype('uint8').reshape((-1,))
+        return self.is_edge(users, items).astype('uint8').reshape((-1,))
 
     def getUserPosItems(self, users):
-        posItems = []
-        for user in users:
-            posItems.append(self.UserItemNet[user].nonzero()[1])
-        return posItems 
+        return [self._allPos[user] for user in users]
         
     def getItemPosUsers(self, items):
-        posUsers = []
-        for item in items:
-            posUsers.append(self.UserItemNet[:,item].nonzero()[0])
-        return posUsers 
+        return [self._allPos_item[item] for item in items]
+
+    def getUserPosItemsBatch(self, users):
+        '''
+        return: (index in users, item) of every training interaction of the batch, e.g. to mask them in ratings
+        '''
+        return self._allPos.batch(users)
+
+    def getItemPosUsersBatch(self, items):
+        '''
+        return: (index in items, user) of every training interaction of the batch
+        '''
+        return self._allPos_item.batch(items)
 
     def get_edge_indices(self):
         '''
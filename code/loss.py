@@ -141,7 +141,7 @@ class Adaptive_loss(torch.nn.Module):
         self.precal = precal
         self.tau = config['temp_tau']
         self.f = lambda x: torch.exp(x / self.tau)
-        self.MLP_model = MLP(5+2*0).to(world.device)
+        self.MLP_model = MLP(5+2*0+int(config['ppr'])).to(world.device)
 
     def adaptive_loss(self, users_emb, pos_emb, ada_coef):
         '''
@@ -159,11 +159,14 @@ class Adaptive_loss(torch.nn.Module):
 
         return loss
 
-    def get_popdegree(self, batch_user, batch_pos_item):
-        with torch.no_grad():
-            pop_user = torch.tensor(self.precal.popularity.user_pop_degree_label).to(world.device)[batch_user]
-            pop_item = torch.tensor(self.precal.popularity.item_pop_degree_label).to(world.device)[batch_pos_item]
-        return pop_user, pop_item 
+    def get_popdegree(self, batch_user, batch_pos_item, log=False):
+        '''
+        degree (or log degree) of the batch, gathered from the feature store on world.device
+        '''
+        features = self.precal.features
+        if log:
+            return features.user_log_degree[batch_user], features.item_log_degree[batch_pos_item]
+        return features.user_degree[batch_user], features.item_degree[batch_pos_item] 
     
     def get_centroid(self, batch_user, batch_pos_item, centroid='eigenvector', aggr='mean', mode='GCA'):
         with torch.no_grad():
@@ -181,6 +184,18 @@ class Adaptive_loss(torch.nn.Module):
             batch_weight2 = torch.tensor(np.array(batch_weight2).reshape((-1,))).to(world.device)
         return batch_weight1, batch_weight2
 
+    def get_ppr(self, batch_user, batch_pos_item):
+        '''
+        approximate personalized PageRank of the positive item from the user (PersonalizedPageRank)
+        '''
+        with torch.no_grad():
+            n_users = self.model.num_users
+            csr_matrix_ppr = self.precal.personalized_pagerank.ppr_mat_sp
+            batch_user, batch_pos_item = np.array(batch_user.cpu()), np.array(batch_pos_item.cpu())
+            batch_weight = csr_matrix_ppr[batch_user, batch_pos_item+n_users]
+            batch_weight = torch.tensor(np.array(batch_weight).reshape((-1,))).to(world.device)
+        return batch_weight
+
     def get_mlp_input(self, features):
         '''
         features = [tensor, tensor, ...]
@@ -198,15 +213,16 @@ class Adaptive_loss(torch.nn.Module):
         the bigger, the more reliable, the more important
         '''
         if method == 'mlp':
-            batch_weight_pop_user, batch_weight_pop_item = self.get_popdegree(batch_user, batch_pos_item)
+            batch_weight_pop_user, batch_weight_pop_item = self.get_popdegree(batch_user, batch_pos_item, log=True)
             # batch_weight_pop_user = torch.ones_like(batch_weight_pop_user)*math.log(self.precal.popularity.max_pop_u)-torch.log(batch_weight_pop_user)#TODO problem of grandeur and +-
             # batch_weight_pop_item = torch.ones_like(batch_weight_pop_item)*math.log(self.precal.popularity.max_pop_i)-torch.log(batch_weight_pop_item)
             #batch_weight_homophily = self.get_homophily(batch_user, batch_pos_item)
-            batch_weight_pop_user, batch_weight_pop_item = torch.log(batch_weight_pop_user), torch.log(batch_weight_pop_item)
             batch_weight_centroid = self.get_centroid(batch_user, batch_pos_item, centroid=mode, aggr='mean', mode='GCA')
             batch_weight_centroid = torch.ones_like(batch_weight_centroid) - batch_weight_centroid#TODO 反向centroid
             batch_weight_commonNeighbor1, batch_weight_commonNeighbor2 = self.get_commonNeighbor(batch_user, batch_pos_item)
             features = [batch_weight_pop_user, batch_weight_pop_item, batch_weight_centroid, batch_weight_commonNeighbor1, batch_weight_commonNeighbor2]
+            if self.config['ppr']:
+                features.append(self.get_ppr(batch_user, batch_pos_item))
             
             # for i in range(self.config['latent_dim_rec']):
             #     features.append(batch_weight_emb_user[:,i])
@@ -45,7 +45,13 @@ def parse_args():
     parser.add_argument('--loss', type=str, default='Adaptive', help="loss function: Adaptive")
     parser.add_argument('--augment', type=str, default='No', help="Augmentation: No, Adaptive, Learner")    
     parser.add_argument('--centroid_mode', type=str, default='eigenvector', help="Centroid mode: degree, pagerank, eigenvector")
+    parser.add_argument('--graph_backend', type=str, default='native', help="graph algorithms backend: native (CSR), networkx")
+    parser.add_argument('--out_of_core', type=int, default=0, help="keep interaction arrays memory-mapped from the binary cache, for logs larger than RAM")
+    parser.add_argument('--compact_ids', type=int, default=1, help="map raw user/item ids to dense indices at load time, gaps in the raw ids cost no embedding rows")
+    parser.add_argument('--num_workers', type=int, default=4, help="DataLoader workers of the sampler, they share its arrays so more workers cost no extra memory")
     parser.add_argument('--commonNeighbor_mode', type=str, default='SC', help="Common Neighbor mode: JS, SC, CN, LHN")
+    parser.add_argument('--ppr', type=int, default=0, help="whether add the personalized PageRank of (user, item) to the MLP input, forward push on the training graph")
+    parser.add_argument('--ppr_eps', type=float, default=1e-4, help="residual threshold of the personalized PageRank push, cost per user ~ 1/ppr_eps")
     parser.add_argument('--adaptive_method', type=str, default='mlp', help="Adaptive coef method: centroid, commonNeighbor, homophily, mlp")
     parser.add_argument('--init_method', type=str, default='Normal', help="UI embeddings init method: Xavier or Normal")
     parser.add_argument('--perplexity', type=int, default=50, help="perplexity for T-SNE")
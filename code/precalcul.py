@@ -7,14 +7,13 @@ Created on Dec 18, 2022
 import world
 import torch
 import numpy as np
-import torch_scatter
-from dataloader import dataset
-import networkx as nx
+from dataloader import dataset, CSRView, EdgeIndex, CHUNK_EDGES
+import datacache
 from tqdm import tqdm
 import torch.nn.functional as F
 import os
 import time
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, save_npz, load_npz
 import torch_sparse
 from torch.utils.data import Dataset
 import random
@@ -24,13 +23,17 @@ class precalculate():
     def __init__(self, config, dataset):
         
         self.P = Pop(dataset)
+        self.F = PopFeatures(self.P)
         self.C = None
         self.CN = None
+        self.PPR = None
         
         if config['adaptive_method'] in ['centroid', 'mlp']:
             self.C = Centroid(dataset, self.P)
         if config['adaptive_method'] in ['commonNeighbor', 'mlp']:
             self.CN = CommonNeighbor(dataset)
+        if config['adaptive_method'] in ['mlp'] and config['ppr']:
+            self.PPR = PersonalizedPageRank(dataset)
         if config['augment'] in ['SVD'] and config['if_SVD']:
             self.SVD_Graph = SVD(dataset)
         
@@ -38,6 +41,24 @@ class precalculate():
     def popularity(self):
         return self.P
     
+    @property
+    def features(self):
+        return self.F
+
+    def add_interactions(self, dataset, users, items, raw_ids=False):
+        '''
+        dataset.add_interactions, then update the popularity (Pop.update), its feature store and the centrality (Centroid.update)
+        with the new edges only\n
+        return: (changed_users, changed_items) of dataset.add_interactions
+        '''
+        E, n_old, m_old = dataset.trainDataSize, dataset.n_users, dataset.m_items
+        changed = dataset.add_interactions(users, items, raw_ids)
+        self.P.update(dataset.trainUser[E:], dataset.trainItem[E:], dataset.n_users, dataset.m_items)
+        self.F.refresh(self.P)
+        if self.C is not None:
+            self.C.update(*changed, n_old, m_old)
+        return changed
+
     @property
     def centroid(self):
         return self.C
@@ -46,26 +67,113 @@ class precalculate():
     def common_neighbor(self):
         return self.CN
 
+    @property
+    def personalized_pagerank(self):
+        return self.PPR
+
     @property
     def svd(self):
         return self.SVD_Graph
         
 #=============================================================Popularity============================================================#
+def pop_groups(TrainPop, num_node, num_group):
+    '''
+    TrainPop: {node: degree}, ties are broken by the order of the dict (first appearance in train)\n
+    return: (nodes of every group, group label of every node).
+    Nodes sorted by degree are cut every int(num_node/num_group), the last group takes the rest;
+    nodes missing from TrainPop get label 0.
+    '''
+    nodes = np.fromiter(TrainPop.keys(), dtype=np.int64, count=len(TrainPop))
+    pop = np.fromiter(TrainPop.values(), dtype=np.int64, count=len(TrainPop))
+    order = np.argsort(pop, kind='stable')
+    groups = np.split(nodes[order], np.arange(1, num_group) * int(num_node / num_group))
+    label = np.zeros(num_node, dtype=np.int64)
+    for group, members in enumerate(groups):
+        label[members] = group
+    return groups, label
+
+def label_groups(pop, label, num_group):
+    '''
+    {group: tensor of its nodes by increasing popularity} rebuilt from the labels, nodes with popularity 0 are left out
+    '''
+    nodes = np.flatnonzero(pop > 0)
+    nodes = nodes[np.argsort(pop[nodes], kind='stable')]
+    nodes = nodes[np.argsort(label[nodes], kind='stable')]
+    bounds = np.cumsum(np.bincount(label[nodes], minlength=num_group))[:-1]
+    return {group: torch.from_numpy(members) for group, members in enumerate(np.split(nodes, bounds))}
+
+class PopSketch():
+    """
+    popularity counter of the users (or items) with the histogram of the popularity values.\n
+    Popularity is an integer degree, so the histogram is an exact quantile sketch whose size is the largest degree:
+    the rank where a popularity level ends is a cumsum over it, whatever the number of nodes.
+    """
+    def __init__(self, degree, floor=0):
+        self.floor = floor#popularity of nodes without training interactions, 0 leaves them out of the groups
+        self.degree = np.array(degree, dtype=np.int64)
+        self.pop = np.maximum(self.degree, floor)
+        self.hist = np.zeros(1, dtype=np.int64)
+        self.total = 0
+        self._count(self.pop, 1)
+
+    def _count(self, pop, sign):
+        part = np.bincount(pop)
+        if len(part) > len(self.hist):
+            self.hist = np.pad(self.hist, (0, len(part) - len(self.hist)))
+        self.hist[:len(part)] += sign * part
+        self.total += sign * int(pop.sum())
+
+    @property
+    def max_pop(self):
+        return int(np.flatnonzero(self.hist)[-1]) if self.hist.any() else 0
+
+    def add(self, nodes, size):
+        '''
+        nodes: one entry per new interaction, size: number of nodes after the update (new nodes get popularity floor)\n
+        return: nodes whose popularity may have changed (the touched and the new ones)
+        '''
+        old_size = len(self.degree)
+        if size > old_size:
+            self.degree = np.pad(self.degree, (0, size - old_size))
+            self.pop = np.pad(self.pop, (0, size - old_size), constant_values=self.floor)
+            self._count(self.pop[old_size:], 1)
+        touched, counts = np.unique(nodes, return_counts=True)
+        self._count(self.pop[touched], -1)
+        self.degree[touched] += counts
+        self.pop[touched] = np.maximum(self.degree[touched], self.floor)
+        self._count(self.pop[touched], 1)
+        return np.union1d(touched, np.arange(old_size, size))
+
+    def label(self, nodes, num_group):
+        '''
+        group of nodes from the quantiles: the group of the last rank of their popularity level,
+        with the cuts of pop_groups (every int(size/num_group) nodes)
+        '''
+        pop = self.pop[nodes]
+        rank = (np.cumsum(self.hist) - self.hist[0])[pop] - 1
+        per = int(len(self.pop) / num_group)
+        label = np.minimum(rank // per, num_group - 1) if per > 0 else np.full(len(nodes), num_group - 1)
+        return np.where(pop > 0, label, 0)
+
 class Pop():
     """
     precalculate popularity of users and items
     """
+    rebuild_ratio = 0.05#update() falls back to rebuild() once this fraction of the nodes was relabeled by the sketch
     def __init__(self, dataset:dataset):
         self.TrainPop_item = dataset.TrainPop_item #item's popularity (degree) in the training dataset
         self.TrainPop_user = dataset.TrainPop_user #user's popularity (degree) in the training dataset
         self.num_item = dataset.m_items
         self.num_user = dataset.n_users
-        self.UInet = dataset.UserItemNet
+        self.num_group = world.config['pop_group']
         self.testDict = dataset.testDict
+        self.testUser, self.testItem = np.asarray(dataset.testUser), np.asarray(dataset.testItem)
+        #counters for update(), item的热度至少为1（与TrainPop_item一致）
+        self.item_sketch = PopSketch(dataset.item_degree, floor=1)
+        self.user_sketch = PopSketch(dataset.user_degree)
 
         #self.pop_statistic()
-        self._ItemPopGroupDict, self._reverse_ItemPopGroupDict, self._testDict_PopGroup = self.build_pop_item()
-        self._UserPopGroupDict, self._reverse_UserPopGroupDict = self.build_pop_user()
+        self.rebuild()
         #self.pop_label()
         self._pop_bias_Dict = self.pop_bias()
 
@@ -77,27 +185,26 @@ class Pop():
             group9 : tensor([item0, ..., itemM])
         }
         '''
+        if self._ItemPopGroupDict is None:
+            self._ItemPopGroupDict = label_groups(self.item_sketch.pop, self._item_pop_label, self.num_group)
         return self._ItemPopGroupDict
 
     @property
     def reverse_ItemPopGroupDict(self):
         '''
-        {
-            item0 : groupN
-            item9 : groupM
-        }
+        array, reverse_ItemPopGroupDict[item] = group of item, same as item_pop_group_label
         '''
-        return self._reverse_ItemPopGroupDict
+        return self._item_pop_label
 
     @property
-    def testDict_PopGroup(self):
+    def test_group_count(self):
         '''
-        {
-            group0 : {user0 : [item0, ..., itemN ],  user9 : [item0, ..., itemM ]}
-            group9 : {user0 : [item0, ..., itemN'],  user9 : [item0, ..., itemM']}
-        }
+        csr_matrix (num_user, num_group), test_group_count[user, group] = number of test items of user in group\n
+        with item_pop_group_label it replaces the per-group test dicts: a hit is in the group of the predicted item
         '''
-        return self._testDict_PopGroup
+        if self._test_group_count is None:
+            self._test_group_count = self.build_test_group_count()
+        return self._test_group_count
 
     @property
     def UserPopGroupDict(self):
@@ -107,17 +214,16 @@ class Pop():
             group9 : tensor([user0, ..., userM])
         }
         '''
+        if self._UserPopGroupDict is None:
+            self._UserPopGroupDict = label_groups(self.user_sketch.pop, self._user_pop_label, self.num_group)
         return self._UserPopGroupDict
 
     @property
     def reverse_UserPopGroupDict(self):
         '''
-        {
-            user0 : groupN
-            user9 : groupM
-        }
+        array, reverse_UserPopGroupDict[user] = group of user, same as user_pop_group_label
         '''
-        return self._reverse_UserPopGroupDict
+        return self._user_pop_label
         
     @property
     def pop_bias_Dict(self):
@@ -138,7 +244,7 @@ class Pop():
         '''
         [pop_degree_of_item_0, ..., pop_degree_of_item_999]
         '''
-        return self._item_pop
+        return self.item_sketch.pop
     
     @property
     def user_pop_group_label(self):
@@ -152,94 +258,72 @@ class Pop():
         '''
         [pop_degree_of_user_0, ..., pop_degree_of_user_999]
         '''
-        return self._user_pop
+        return self.user_sketch.pop
 
     @property
     def item_pop_sum(self):
         '''
         total number of items' popularity degree
         '''
-        return sum(self._item_pop)
+        return self.item_sketch.total
+
+    def rebuild(self):
+        '''
+        exact groups from a full sort of the popularity, also drops the drift of the labels kept by update()
+        '''
+        self._ItemPopGroupDict, self._item_pop_label = self.build_pop_item()
+        self._UserPopGroupDict, self._user_pop_label = self.build_pop_user()
+        self._test_group_count = self.build_test_group_count()
+        self._drift = 0
+
+    def update(self, users, items, n_user, m_item):
+        '''
+        users, items: new training interactions (dense ids), n_user/m_item: number of users/items after them\n
+        Only the sketches and the users/items of the new interactions are updated, O(new interactions + max degree):
+        a changed node gets the group of the last rank of its popularity (it sorts last among its ties, as new nodes in TrainPop),
+        the others keep their label. Once rebuild_ratio of the nodes were relabeled this way the boundaries have drifted
+        and rebuild() sorts everything again, so the cost stays O(log n) per changed node on average.
+        Group dicts and test_group_count are rebuilt from the labels the next time they are read.
+        '''
+        self.num_user, self.num_item = n_user, m_item
+        changed_users = self.user_sketch.add(np.asarray(users, dtype=np.int64), n_user)
+        changed_items = self.item_sketch.add(np.asarray(items, dtype=np.int64), m_item)
+        self.max_pop_u, self.max_pop_i = self.user_sketch.max_pop, self.item_sketch.max_pop
+        self._drift += len(changed_users) + len(changed_items)
+        if self._drift > self.rebuild_ratio * (n_user + m_item):
+            self.rebuild()
+            return changed_users, changed_items
+
+        self._user_pop_label = np.pad(self._user_pop_label, (0, n_user - len(self._user_pop_label)))
+        self._item_pop_label = np.pad(self._item_pop_label, (0, m_item - len(self._item_pop_label)))
+        user_label = self.user_sketch.label(changed_users, self.num_group)
+        item_label = self.item_sketch.label(changed_items, self.num_group)
+        if self._test_group_count is not None and \
+                ((self._item_pop_label[changed_items] != item_label).any() or n_user > self._test_group_count.shape[0]):
+            self._test_group_count = None
+        self._user_pop_label[changed_users] = user_label
+        self._item_pop_label[changed_items] = item_label
+        self._UserPopGroupDict, self._ItemPopGroupDict = None, None
+        return changed_users, changed_items
 
     def build_pop_item(self):
-        num_group = world.config['pop_group']
-        item_per_group = int(self.num_item / num_group)
-        TrainPopSorted = sorted(self.TrainPop_item.items(), key=lambda x: x[1])
-        self.max_pop_i = TrainPopSorted[-1][1]
-        ItemPopGroupDict = {}#查询分组中有哪些item的字典
-        testDict_PopGroup = {}#查询不同分组下用户在Test集中交互过的item的字典
-        reverse_ItemPopGroupDict = {}#查询item属于哪个分组的字典
-        self._item_pop_label = [0]*self.num_item
-        self._item_pop = [0]*self.num_item
+        groups, item_pop_label = pop_groups(self.TrainPop_item, self.num_item, self.num_group)
+        self.max_pop_i = self.item_sketch.max_pop
         #按照Pop分组，并存储至字典[0=Cold, 9=Hot]
-        for group in range(num_group):
-            ItemPopGroupDict[group] = []
-            if group == num_group-1:
-                for item, pop in TrainPopSorted[group * item_per_group:]:
-                    ItemPopGroupDict[group].append(item)
-                    reverse_ItemPopGroupDict[item] = group
-                    self._item_pop_label[item] = group
-                    self._item_pop[item] = pop
-            else:
-                for item, pop in TrainPopSorted[group * item_per_group: (group+1) * item_per_group]:
-                    ItemPopGroupDict[group].append(item)
-                    reverse_ItemPopGroupDict[item] = group
-                    self._item_pop_label[item] = group
-                    self._item_pop[item] = pop
-        self._item_pop_label = np.array(self._item_pop_label)
-        #转换为tensor格式
-        for group, items in ItemPopGroupDict.items():
-            ItemPopGroupDict[group] = torch.tensor(items)
-
-        #初始化testDict_PopGroup的格式：testDict_PopGroup={0:{user:ColdItem}}
-        for group in range(num_group):
-            testDict_PopGroup[group] = {}
-        #生成不同热度分组下的用户test交互item字典
-        for user, items in self.testDict.items():                
-            Hot = {}
-            for group in range(num_group):
-                Hot[group] = []
-            for item in items:
-                group = reverse_ItemPopGroupDict[item]
-                Hot[group].append(item)
-            for group in range(num_group):
-                if Hot[group]:
-                    testDict_PopGroup[group][user] = Hot[group]
-                else:
-                    testDict_PopGroup[group][user] = [999999999999999]#缺省值
-        #print(testDict_PopGroup[0])
-        return ItemPopGroupDict, reverse_ItemPopGroupDict, testDict_PopGroup
+        ItemPopGroupDict = {group: torch.from_numpy(items) for group, items in enumerate(groups)}#查询分组中有哪些item的字典
+        return ItemPopGroupDict, item_pop_label
 
     def build_pop_user(self):
-        num_group = world.config['pop_group']
-        user_per_group = int(self.num_user / num_group)
-        TrainPopSorted = sorted(self.TrainPop_user.items(), key=lambda x: x[1])
-        self.max_pop_u = TrainPopSorted[-1][1]
-        UserPopGroupDict = {}#查询分组中有哪些item的字典
-        reverse_UserPopGroupDict = {}#查询item属于哪个分组的字典
-        self._user_pop_label = [0]*self.num_user
-        self._user_pop = [0]*self.num_user
+        groups, user_pop_label = pop_groups(self.TrainPop_user, self.num_user, self.num_group)
+        self.max_pop_u = self.user_sketch.max_pop
         #按照Pop分组，并存储至字典[0=Cold, 9=Hot]
-        for group in range(num_group):
-            UserPopGroupDict[group] = []
-            if group == num_group-1:
-                for user, pop in TrainPopSorted[group * user_per_group:]:
-                    UserPopGroupDict[group].append(user)
-                    reverse_UserPopGroupDict[user] = group
-                    self._user_pop_label[user] = group
-                    self._user_pop[user] = pop
-            else:
-                for user, pop in TrainPopSorted[group * user_per_group: (group+1) * user_per_group]:
-                    UserPopGroupDict[group].append(user)
-                    reverse_UserPopGroupDict[user] = group
-                    self._user_pop_label[user] = group
-                    self._user_pop[user] = pop
-        self._user_pop_label = np.array(self._user_pop_label)
-        #转换为tensor格式
-        for group, users in UserPopGroupDict.items():
-            UserPopGroupDict[group] = torch.tensor(users)
-        
-        return UserPopGroupDict, reverse_UserPopGroupDict
+        UserPopGroupDict = {group: torch.from_numpy(users) for group, users in enumerate(groups)}#查询分组中有哪些user的字典
+        return UserPopGroupDict, user_pop_label
+
+    def build_test_group_count(self):
+        #不同热度分组下用户在Test集中交互过的item数：test_group_count[user, group]
+        return csr_matrix((np.ones(len(self.testItem), dtype=np.int32), (self.testUser, self._item_pop_label[self.testItem])),
+                          shape=(self.num_user, self.num_group))#重复的(user, group)在转换时相加
 
     def pop_bias(self):
         '''
@@ -248,6 +332,29 @@ class Pop():
         pop_bias_Dict = {}
         return pop_bias_Dict
 
+#=============================================================Popularity Features============================================================#
+class PopFeatures():
+    """
+    popularity features of users and items kept on world.device, the losses only gather from them by index
+    """
+    def __init__(self, pop:Pop, device=world.device):
+        self.device = device
+        self.refresh(pop)
+
+    def refresh(self, pop:Pop):
+        '''
+        (re)build every tensor from pop, e.g. after interactions were added\n
+        degree and group are long (embedding / cross entropy indices), log_degree and norm_pop are float32
+        '''
+        self.user_degree = torch.as_tensor(np.asarray(pop.user_pop_degree_label, dtype=np.int64)).to(self.device)
+        self.item_degree = torch.as_tensor(np.asarray(pop.item_pop_degree_label, dtype=np.int64)).to(self.device)
+        self.user_log_degree = torch.log(self.user_degree.float())
+        self.item_log_degree = torch.log(self.item_degree.float())
+        self.user_group = torch.as_tensor(np.asarray(pop.user_pop_group_label, dtype=np.int64)).to(self.device)
+        self.item_group = torch.as_tensor(np.asarray(pop.item_pop_group_label, dtype=np.int64)).to(self.device)
+        self.user_norm_pop = self.user_degree.float() / self.user_degree.sum()
+        self.item_norm_pop = self.item_degree.float() / pop.item_pop_sum
+
 #=============================================================Node & Edge Centroid============================================================#
 class Centroid():
     def __init__(self, dataset:dataset, pop:Pop):
@@ -255,10 +362,6 @@ class Centroid():
         self.pop = pop
         self.mode = world.config['centroid_mode']
 
-        #nodes_out == edge_index[0]
-        #nodes_in == edge_index[1]
-        self.nodes_out = torch.cat((torch.tensor(self.dataset._trainUser), torch.tensor(self.dataset._trainItem+self.dataset.n_users)))
-        self.nodes_in =  torch.cat((torch.tensor(self.dataset._trainItem+self.dataset.n_users), torch.tensor(self.dataset._trainUser)))
         if world.config['centroid_mode'] in ['degree']:
             self._degree_item = torch.tensor(self.pop.item_pop_degree_label) #item's popularity (degree) in the training dataset
             self._degree_user = torch.tensor(self.pop.user_pop_degree_label) #user's popularity (degree) in the training dataset
@@ -272,6 +375,8 @@ class Centroid():
             self._eigenvector_user, self._eigenvector_item = self._eigenvector_user.to(world.device), self._eigenvector_item.to(world.device)
         else:
             raise TypeError('centroid mode not implemented')
+        self._edge_weights = {}#(centroid, aggr, mode) -> per-edge weights, see edge_weight_table
+        self._edge_keys = None#edge lookup on world.device, see edge_lookup_tensors
         # look = torch.tensor([0,1,2,3,4,5,6,7,8,9,10,11,12])
         # print('degree_user', self._degree_user[look])
         # print('degree_item', self._degree_item[look])
@@ -283,24 +388,34 @@ class Centroid():
         #print(self.get_edge_index_batch(torch.tensor([0,0,0,1,1]),torch.tensor([0,1,2,17,18])))
 
 
-    def compute_pr(self, damp=0.85, k=15):
+    def compute_pr(self, damp=0.85, max_iter=100, tol=1e-06, x0=None):
         '''
         For undirected graph, calculate twice pagerank in two direction\n
         U:|0   U-I|
-        I:|I-U   0|
+        I:|I-U   0|\n
+        PR <- (1 - damp) * PR + damp * A @ D^(-1) @ PR by sparse matvec (GraphView.pagerank), from x0 if given (warm start),
+        until the mean change is below tol; a warning is printed if max_iter stops it first.
+        Saved in PRECALPATH under the graph hash (dataset.source_hash) and the solver parameters, later runs only load it.
         '''
         start = time.time()
         num_nodes = self.dataset.n_users + self.dataset.m_items
-        deg_out = torch.cat((torch.tensor(self.pop.user_pop_degree_label), torch.tensor(self.pop.item_pop_degree_label)))
-        PR = torch.ones((num_nodes, )).to(torch.float32)
-        nodes_out = self.nodes_out
-        nodes_in =  self.nodes_in
-
-        for i in range(k):
-            edge_msg = PR[nodes_out] / deg_out[nodes_out]
-            agg_msg = torch_scatter.scatter(edge_msg, nodes_in, reduce='sum')
-
-            PR = (1 - damp) * PR + damp * agg_msg
+        precal_path = os.path.join(world.PRECALPATH, 'PageRankCentroid')
+        file = os.path.join(precal_path, f'PageRank_{self.dataset.source_hash}_damp{damp}_tol{tol}_iter{max_iter}.pt')
+        if os.path.exists(file):
+            print(f'Loading {os.path.basename(file)} from {precal_path}')
+            PR = torch.load(file)
+        else:
+            if x0 is not None:#nodes added since x0 start from 1 as in a cold start
+                x0 = np.pad(np.asarray(x0, dtype=np.float64), (0, num_nodes - len(x0)), constant_values=1.)
+            PR, n_iter, err = self.dataset.graph_view.pagerank(damp=damp, max_iter=max_iter, tol=tol, x0=x0)
+            if err >= tol:
+                world.cprint(f'pagerank did not converge in {max_iter} iterations: residual {err:.2e} > tol {tol:.0e}, raise max_iter')
+            else:
+                print(f'pagerank: converged in {n_iter} iterations, residual {err:.2e}')
+            PR = torch.from_numpy(PR).float()
+            os.makedirs(precal_path, exist_ok=True)
+            torch.save(PR, file)
+            print(f'Save {os.path.basename(file)} to {precal_path}')
 
         users_pagerank, items_pagerank = torch.split(PR, [self.dataset.n_users, self.dataset.m_items])
         end = time.time()
@@ -308,27 +423,32 @@ class Centroid():
         return users_pagerank, items_pagerank
 
     def eigenvector_centrality(self):
+        '''
+        Saved in PRECALPATH under the graph hash (dataset.source_hash, which also covers the id compaction and the train/valid split),
+        later runs only load it. Vectors of another node layout are never reused.
+        '''
         start = time.time()
         precal_path = os.path.join(world.PRECALPATH,'EigenvectorCentroid')
-        if os.path.exists(os.path.join(precal_path, 'Eigenvector.pt')):
-            print(f'Loading Eigenvector.pt from {precal_path}')
-            x = torch.load(os.path.join(precal_path, 'Eigenvector.pt'))
+        file = os.path.join(precal_path, f'Eigenvector_{self.dataset.source_hash}.pt')
+        if os.path.exists(file):
+            print(f'Loading {os.path.basename(file)} from {precal_path}')
+            x = torch.load(file)
             eigenvector_centrality_user, eigenvector_centrality_item = torch.split(x, [self.dataset.n_users, self.dataset.m_items])
         else:
-            nx_graph = self.dataset.nx_Graph #TODO 在dataset中用额外的nx_Graph存储networkx格式有点浪费内存！
-            try:
-                x = nx.eigenvector_centrality(nx_graph, max_iter=100, tol=1e-04)
-            except:
-                x = nx.eigenvector_centrality(nx_graph, max_iter=100, tol=5e-04)
-
-            num_nodes = self.dataset.n_users + self.dataset.m_items
-            x = torch.tensor([x[i] for i in range(num_nodes)])
+            if world.config['graph_backend'] == 'networkx':
+                import networkx as nx
+                nx_graph = self.dataset.graph_view.to_networkx()
+                x = nx.eigenvector_centrality(nx_graph, max_iter=100, tol=1e-04)#PowerIterationFailedConvergence if it does not converge
+                num_nodes = self.dataset.n_users + self.dataset.m_items
+                x = torch.tensor([x[i] for i in range(num_nodes)])
+            else:
+                x, n_iter, err = self.dataset.graph_view.eigenvector_centrality(max_iter=100, tol=1e-04)
+                print(f'eigenvector centrality: converged in {n_iter} iterations, residual {err:.2e} ({self.dataset.graph_view.threads} threads)')
+                x = torch.from_numpy(x).float()
             
-            if not os.path.exists(precal_path):
-                os.makedirs(precal_path, exist_ok=True)
-            precal_path = os.path.join(precal_path, 'Eigenvector.pt')
-            torch.save(x, precal_path)
-            print(f'Save Eigenvector.pt to {precal_path}')
+            os.makedirs(precal_path, exist_ok=True)
+            torch.save(x, file)
+            print(f'Save {os.path.basename(file)} to {precal_path}')
 
             eigenvector_centrality_user, eigenvector_centrality_item = torch.split(x, [self.dataset.n_users, self.dataset.m_items])
         end = time.time()
@@ -364,27 +484,58 @@ class Centroid():
         
     #     return weights
 
-    def cal_centroid_weights_batch(self, batch_user:torch.Tensor, batch_item:torch.Tensor, centroid='degree', aggr='mean', mode='GCA'):
+    def update(self, changed_users, changed_items, n_old, m_old):
+        '''
+        bring the centrality up to date after dataset.add_interactions (see precalculate.add_interactions)\n
+        degree is read from Pop again. PageRank and eigenvector start from the previous vector (new nodes as in a cold start):
+        for the eigenvector, local sweeps around the touched nodes absorb the new edges first (GraphView.eigenvector_sweeps);
+        then the usual solver continues until its tolerance, which takes a few iterations instead of a full solve.
+        PageRank only gets the warm-started global sweeps: without teleport its iteration keeps the mass of every
+        connected component, which sweeps on a part of the graph would not.
+        The per-edge weight tables are dropped.
+        '''
+        start = time.time()
+        n_new, m_new = self.dataset.n_users, self.dataset.m_items
+        seeds = np.concatenate((np.asarray(changed_users, dtype=np.int64), np.asarray(changed_items, dtype=np.int64) + n_new))
+        def warm_start(user_vec, item_vec, fill):
+            return np.concatenate((user_vec.cpu().double().numpy(), np.full(n_new - n_old, fill),
+                                   item_vec.cpu().double().numpy(), np.full(m_new - m_old, fill)))
+        if self.mode in ['degree']:
+            self._degree_item = torch.tensor(self.pop.item_pop_degree_label).to(world.device)
+            self._degree_user = torch.tensor(self.pop.user_pop_degree_label).to(world.device)
+        elif self.mode in ['pagerank']:
+            self._pagerank_user, self._pagerank_item = self.compute_pr(x0=warm_start(self._pagerank_user, self._pagerank_item, 1.))
+            self._pagerank_user, self._pagerank_item = self._pagerank_user.to(world.device), self._pagerank_item.to(world.device)
+        elif self.mode in ['eigenvector']:
+            x0 = warm_start(self._eigenvector_user, self._eigenvector_item, 1. / (n_new + m_new))
+            x0, n_sweep, work = self.dataset.graph_view.eigenvector_sweeps(x0, seeds, tol=1e-04)
+            x, n_iter, err = self.dataset.graph_view.eigenvector_centrality(max_iter=100, tol=1e-04, x0=x0)
+            print(f'eigenvector local sweeps: {n_sweep} sweeps, {work} node updates, then {n_iter} iterations, residual {err:.2e}')
+            x = torch.from_numpy(x).float()
+            self._eigenvector_user, self._eigenvector_item = torch.split(x.to(world.device), [n_new, m_new])
+        self._edge_weights = {}
+        self._edge_keys = None
+        print('centroid update cost: ', time.time() - start)
+
+    def centrality(self, centroid):
+        '''
+        return: (centrality of users, centrality of items) on world.device
         '''
-        input: batch_user and their pos items\n
-        return weights: torch.tensor([w_edge_1, ..., w_edge_n])\n
-        egde indiced by  self.nodes_out(row) --- self.nodes_in(col)\n
-        edge between users and items are not guaranteed by this function.
-        ''' 
         if centroid == 'degree':
-            centroid_user = self._degree_user[batch_user]
-            centroid_item = self._degree_item[batch_item]
+            return self._degree_user, self._degree_item
         elif centroid == 'pagerank':
-            centroid_user = self._pagerank_user[batch_user]
-            centroid_item = self._pagerank_item[batch_item]
+            return self._pagerank_user, self._pagerank_item
         elif centroid == 'eigenvector':
-            centroid_user = self._eigenvector_user[batch_user]
-            centroid_item = self._eigenvector_item[batch_item]
-        else:
-            raise TypeError('No demanded centroid')
+            return self._eigenvector_user, self._eigenvector_item
+        raise TypeError('No demanded centroid')
 
-        s_u = torch.log(centroid_user)
-        s_i = torch.log(centroid_item)
+    def edge_scores(self, users:torch.Tensor, items:torch.Tensor, centroid='degree', aggr='mean'):
+        '''
+        s = log centrality of the edges users[k] --- items[k], aggregated over both ends as in aggr
+        '''
+        centroid_user, centroid_item = self.centrality(centroid)
+        s_u = torch.log(centroid_user[users])
+        s_i = torch.log(centroid_item[items])
         if aggr == 'item':
             s = s_i
         elif aggr == 'user':
@@ -393,27 +544,70 @@ class Centroid():
             s = (s_u + s_i) * 0.5
         else:
             s = s_i
-        
-        if mode == 'GCA':
-            weights = (s.max() - s) / (s.max() - s.mean())
-            #TODO here max() is just in the batch. In the future version, should consider global information
-        elif mode == 'mean':
-            weights = F.softmax(s) #softmax( log(x) ) = mean(x)
-        else:
-            weights = s
-        
-        return weights
+        return s
+
+    def edge_weight_table(self, centroid='degree', aggr='mean', mode='GCA'):
+        '''
+        return: (weights of all training edges indexed by edge id, max and mean of s over all edges), built once per (centroid, aggr, mode)
+        on world.device. GCA uses the global max/mean of s; mode 'mean' is a softmax over the batch, its table only holds s.
+        '''
+        key = (centroid, aggr, 'GCA' if mode == 'GCA' else 's')
+        E = self.dataset.trainDataSize
+        if key not in self._edge_weights or len(self._edge_weights[key][0]) != E:#edges added since the table was built
+            s = torch.empty(E, device=world.device)
+            for start in range(0, E, CHUNK_EDGES):
+                end = min(start + CHUNK_EDGES, E)
+                users = torch.from_numpy(np.asarray(self.dataset.trainUser[start:end], dtype=np.int64)).to(world.device)
+                items = torch.from_numpy(np.asarray(self.dataset.trainItem[start:end], dtype=np.int64)).to(world.device)
+                s[start:end] = self.edge_scores(users, items, centroid, aggr)
+            s_max, s_mean = s.max(), s.mean()
+            weights = (s_max - s) / (s_max - s_mean) if key[2] == 'GCA' else s
+            self._edge_weights[key] = (weights, s_max, s_mean)
+        return self._edge_weights[key]
 
+    def cal_centroid_weights_batch(self, batch_user:torch.Tensor, batch_item:torch.Tensor, centroid='degree', aggr='mean', mode='GCA'):
+        '''
+        input: batch_user and their pos items\n
+        return weights: torch.tensor([w_edge_1, ..., w_edge_n])\n
+        weight k belongs to the edge batch_user[k] --- batch_item[k], gathered from edge_weight_table by edge id,
+        so an edge gets the same weight in every batch.\n
+        edge between users and items are not guaranteed by this function, other pairs are scored with the same global max/mean.
+        ''' 
+        table, s_max, s_mean = self.edge_weight_table(centroid, aggr, mode)
+        batch_user, batch_item = batch_user.to(table.device).long(), batch_item.to(table.device).long()
+        edge_ids = self.get_edge_index_batch(batch_user, batch_item)
+        #no host round trip: pairs that are not edges take the score computed for every pair of the batch
+        s = self.edge_scores(batch_user, batch_item, centroid, aggr)
+        fallback = (s_max - s) / (s_max - s_mean) if mode == 'GCA' else s
+        weights = torch.where(edge_ids >= 0, table[edge_ids.clamp(min=0)], fallback)
+        if mode == 'mean':
+            weights = F.softmax(weights, dim=0) #softmax( log(x) ) = mean(x)
+        return weights
 
 
+    def edge_lookup_tensors(self):
+        '''
+        return: (sorted edge keys, their edge ids, m_item) of dataset.edge_lookup as tensors on world.device,
+        copied once and again only after edges were added
+        '''
+        if self._edge_keys is None or len(self._edge_keys[0]) != self.dataset.trainDataSize:
+            lookup = self.dataset.edge_lookup
+            self._edge_keys = (torch.from_numpy(np.array(lookup.keys, dtype=np.int64)).to(world.device),
+                               torch.from_numpy(np.array(lookup.order, dtype=np.int64)).to(world.device), lookup.m_item)
+        return self._edge_keys
 
     def get_edge_index_batch(self, users:torch.Tensor, items:torch.Tensor):
         '''
         input: users index, items index, both start from 0.\n
-        return: edges index in weights between user and item.\n
+        return: edges index in weights between user and item, on the device of the sorted keys (torch.searchsorted, no host copy).\n
         -1 means no edge between them.
         '''
-        return self.dataset.edge_indices.to_dense()[users, items] - 1
+        keys, order, m_item = self.edge_lookup_tensors()
+        batch_keys = users.to(keys.device).long() * m_item + items.to(keys.device).long()
+        if len(keys) == 0:
+            return torch.full_like(batch_keys, -1)
+        pos = torch.searchsorted(keys, batch_keys).clamp(max=len(keys) - 1)
+        return torch.where(keys[pos] == batch_keys, order[pos], torch.full_like(batch_keys, -1))
 
     def get_edge_index(self, user:int, item:int):
         '''
@@ -421,20 +615,7 @@ class Centroid():
         return: edge index in weights between user and item.\n
         -1 means no edge between them.
         '''
-        trainUser = self.dataset._trainUser.copy()
-        trainItem = self.dataset._trainItem.copy()
-        edge_index = (trainUser==user)*(trainItem==item)
-        try:
-            return np.nonzero(edge_index==True)[0][0]
-        except:
-            return -1
-        return self.dataset.edge_indices[user, item].item() - 1
-        # try:
-        #     return self.dataset.edge_index.index((user,item))
-        # except:
-        #     return -1
-        # edge_index = self.dataset.Graph.indices()
-        # return edge_index[edge_index[0]==user,edge_index[1]==(item+self.dataset.n_users)]
+        return int(self.dataset.edge_lookup.lookup(user, item))
 
 #=============================================================Commmon Neighborhood============================================================#
 class CommonNeighbor():
@@ -523,105 +704,129 @@ class CommonNeighbor():
     #     return edge_weight
 
 
+    @staticmethod
+    def overlap_score(cap, deg_x, deg_y, mode='SC'):
+        '''
+        similarity of two nodes from the size of their common neighborhood cap and their degrees
+        '''
+        if mode == 'JS':
+            return cap / (deg_x + deg_y - cap)
+        elif mode == 'CN':
+            return cap
+        elif mode == 'SC':
+            return cap / np.sqrt(deg_x * deg_y)
+        elif mode == 'LHN':
+            return cap / (deg_x * deg_y)
+        else:
+            raise TypeError('No demanded Common Neighbor Method')
+
+    def mean_overlap(self, R:csr_matrix, mode='SC', desc='', chunk=CHUNK_EDGES):
+        '''
+        R: CSR (x, y) of the distinct neighbors y of every x\n
+        return: for every nonzero (x, y) of R in CSR order, mean of overlap_score(|N(x) & N(x')|, |N(x)|, |N(x')|) over the x' of N(y) (x included)\n
+        Overlaps are S = R[x0:x1] @ R.T (sparse product) on blocks of rows with about chunk two-hop paths x-y-x',
+        the scores are gathered from S along the paths and summed per edge, nothing is dense.
+        '''
+        RT = R.T.tocsr()
+        deg_x, deg_y = np.diff(R.indptr), np.diff(RT.indptr)
+        paths = np.concatenate(([0], np.cumsum(deg_y[R.indices], dtype=np.int64)))
+        neighbors = CSRView(RT.indptr, RT.indices)
+        out = np.empty(R.nnz)
+        for x0, x1 in tqdm(list(datacache.user_blocks(paths[R.indptr], chunk)), desc=desc):
+            e0, e1 = R.indptr[x0], R.indptr[x1]
+            S = (R[x0:x1] @ RT).tocsr()
+            S.sort_indices()
+            S_keys = np.repeat(np.arange(x1 - x0, dtype=np.int64), np.diff(S.indptr)) * R.shape[0] + S.indices
+            edge_x = np.repeat(np.arange(x0, x1), deg_x[x0:x1])
+            edge_y = R.indices[e0:e1]
+            path_edge, path_x = neighbors.batch(edge_y)#path edge_x[path_edge] - edge_y[path_edge] - path_x
+            cap = S.data[np.searchsorted(S_keys, (edge_x[path_edge] - x0).astype(np.int64) * R.shape[0] + path_x)]
+            score = self.overlap_score(cap.astype(np.float64), deg_x[edge_x[path_edge]], deg_x[path_x], mode)
+            out[e0:e1] = np.bincount(path_edge, weights=score, minlength=e1 - e0) / deg_y[edge_y]
+        return out
+
     def CN_simi_unsymmetry_mat_sp(self, mode='SC'):
         """
         return SPARSE edge_weight:\n
         edge_weight[i,j] = importance of i to j\n
         |0        u_to_i|\n
         |i_to_u        0|\n
-        Not symmetry !
+        Not symmetry !\n
+        u_to_i[u, i] is the mean similarity of u to the users of i, i_to_u[i, u] the mean similarity of i to the items of u,
+        computed on the training edges only by mean_overlap (sparse products R @ R.T and R.T @ R by blocks).
+        Saved in PRECALPATH under the graph hash (dataset.source_hash) and the mode, later runs only load it.
         """
         start = time.time()
-        precal_path = os.path.join(world.PRECALPATH,'CommonNeighbor')
-        precal_path = os.path.join(precal_path, f'{mode}')
-        #precal_path = os.path.join(precal_path, 'CommonNeighbor.pt')
-        if os.path.exists(os.path.join(precal_path, 'CommonNeighbor_sp.pt')):
-            print(f'Loading CommonNeighbor_sp.pt from {precal_path}')
-            precal_path = os.path.join(precal_path, 'CommonNeighbor_sp.pt')
-            edge_weight = torch.load(precal_path)
+        precal_path = os.path.join(world.PRECALPATH, 'CommonNeighbor', f'{mode}')
+        file = os.path.join(precal_path, f'CommonNeighbor_{self.dataset.source_hash}_{mode}.npz')
+        if os.path.exists(file):
+            print(f'Loading {os.path.basename(file)} from {precal_path}')
+            edge_weight = load_npz(file).tocsr()
         else:
             n_users = self.dataset.n_users
             n_items = self.dataset.m_items
-            edge_index = self.dataset.Graph.cpu().indices()#item's index starts from n_users, not 0! 
-            
-            #edge_weight = torch.zeros((n_users + n_items, n_users + n_items))
-            row = torch.tensor([])
-            col = torch.tensor([])
-            val = torch.tensor([])
-
-            for i in tqdm(range(n_items), desc=f'Calculating importance of users to item in sparse mode {mode}'):
-                users = edge_index[0, edge_index[1] == (i + n_users)]
-                items = torch.zeros([users.shape[0], n_items])
-
-                for j, user in enumerate(users):
-                    items[j, torch.tensor(self.dataset.allPos[user.item()]).long()] = 1
-
-                user_user_cap = torch.matmul(items, items.t())
-                user_user_cup = items.sum(dim=1) + items.sum(dim=1).unsqueeze(-1)
-
-                if mode == 'JS':
-                    simi = (user_user_cap / (user_user_cup - user_user_cap)).mean(dim=1)
-                elif mode == 'CN':
-                    simi =  user_user_cap.mean(dim=1)
-                elif mode == 'SC':
-                    simi = (user_user_cap / ((items.sum(dim=1) * items.sum(dim=1).unsqueeze(-1))**0.5)).mean(dim=1)
-                elif mode == 'LHN':
-                    simi = (user_user_cap / ((items.sum(dim=1) * items.sum(dim=1).unsqueeze(-1)))).mean(dim=1)
-                else:
-                    raise TypeError('No demanded Common Neighbor Method')
-
-                #edge_weight[users, i + n_users] = simi
-                row = torch.cat((row, users))
-                i_col = torch.tensor([i + n_users]*(users.shape[0]))
-                col = torch.cat((col, i_col))
-                val = torch.cat((val, simi))
-
-            for i in tqdm(range(n_users), desc=f'Calculating importance of items to user in sparse mode {mode}'):
-                items = edge_index[1, edge_index[0] == i]
-                users = torch.zeros([items.shape[0], n_users])
-
-                for j, item in enumerate(items):
-                    users[j, torch.tensor(self.dataset.allPos_item[item.item()-n_users]).long()] = 1
-
-                item_item_cap = torch.matmul(users, users.t())
-                item_item_cup = users.sum(dim=1) + users.sum(dim=1).unsqueeze(-1)
-
-                if mode == 'JS':
-                    simi = (item_item_cap / (item_item_cup - item_item_cap)).mean(dim=1)
-                elif mode == 'CN':
-                    simi =  item_item_cap.mean(dim=1)
-                elif mode == 'SC':
-                    simi = (item_item_cap / ((users.sum(dim=1) * users.sum(dim=1).unsqueeze(-1))**0.5)).mean(dim=1)
-                elif mode == 'LHN':
-                    simi = (item_item_cap / ((users.sum(dim=1) * users.sum(dim=1).unsqueeze(-1)))).mean(dim=1)
-                else:
-                    raise TypeError('No demanded Common Neighbor Method')
-
-                #edge_weight[items, i] = simi
-                row = torch.cat((row, items))
-                i_col = torch.tensor([i]*(items.shape[0]))
-                col = torch.cat((col, i_col))
-                val = torch.cat((val, simi))
-            row = row.long()
-            col = col.long()
-            # index = torch.stack([row, col])
-            # edge_weight = torch.sparse.FloatTensor(index, val, (n_users + n_items, n_users + n_items))
-            # edge_weight = edge_weight.coalesce()
+            allPos = self.dataset.allPos
+            R = csr_matrix((np.ones(len(allPos.indices), dtype=np.float32), allPos.indices, allPos.indptr), shape=(n_users, n_items))
+            RT = R.T.tocsr()
+            u_to_i = self.mean_overlap(R, mode, desc=f'Calculating importance of users to item in sparse mode {mode}')
+            i_to_u = self.mean_overlap(RT, mode, desc=f'Calculating importance of items to user in sparse mode {mode}')
+            row = np.concatenate((np.repeat(np.arange(n_users), np.diff(R.indptr)), np.repeat(np.arange(n_items), np.diff(RT.indptr)) + n_users))
+            col = np.concatenate((R.indices.astype(np.int64) + n_users, RT.indices))
+            val = np.concatenate((u_to_i, i_to_u)).astype(np.float32)
             edge_weight = csr_matrix((val, (row, col)), shape=(n_users + n_items, n_users + n_items))
 
-
-            if not os.path.exists(precal_path):
-                os.makedirs(precal_path, exist_ok=True)
-            
-            precal_path = os.path.join(precal_path, 'CommonNeighbor_sp.pt')
-            torch.save(edge_weight, precal_path)
-            print(f'Save CommonNeighbor_sp.pt to {precal_path}')
-        # edge_weight = edge_weight.coalesce()
+            os.makedirs(precal_path, exist_ok=True)
+            save_npz(file, edge_weight)
+            print(f'Save {os.path.basename(file)} to {precal_path}')
         end = time.time()
         print('CN_simi_unsymmetry_mat_sp cost: ',end-start)
         return edge_weight
 
 
+#=============================================================Personalized PageRank============================================================#
+class PersonalizedPageRank():
+    def __init__(self, dataset:dataset):
+        self.dataset = dataset
+        self.ppr_mat_sp = self.ppr_edge_mat_sp(alpha=0.15, eps=world.config['ppr_eps'])
+
+    def ppr_edge_mat_sp(self, alpha=0.15, eps=1e-04, batch_users=1024):
+        """
+        return SPARSE edge_weight, same layout as CommonNeighbor.CN_simi_mat_sp:\n
+        edge_weight[u, n_users + i] = approximate personalized PageRank of item i from user u, on training edges only\n
+        |0   u_to_i|\n
+        |0        0|\n
+        Forward push from batch_users users at a time (GraphView.personalized_pagerank), the error of every entry is below eps * deg(i).
+        Saved in PRECALPATH under the graph hash (dataset.source_hash), alpha and eps.
+        """
+        start = time.time()
+        n_users, n_items = self.dataset.n_users, self.dataset.m_items
+        precal_path = os.path.join(world.PRECALPATH, 'PersonalizedPageRank')
+        file = os.path.join(precal_path, f'PPR_{self.dataset.source_hash}_alpha{alpha}_eps{eps}.npz')
+        if os.path.exists(file):
+            print(f'Loading {os.path.basename(file)} from {precal_path}')
+            edge_weight = load_npz(file).tocsr()
+        else:
+            rows, cols, vals = [], [], []
+            n_round = 0
+            for u0 in tqdm(range(0, n_users, batch_users), desc=f'Pushing personalized PageRank with eps {eps}'):
+                users = np.arange(u0, min(u0 + batch_users, n_users))
+                P, rounds = self.dataset.graph_view.personalized_pagerank(users, alpha=alpha, eps=eps)
+                row_ids, items = self.dataset.allPos.batch(users)
+                rows.append(users[row_ids])
+                cols.append(items.astype(np.int64) + n_users)
+                vals.append(np.asarray(P[row_ids, items.astype(np.int64) + n_users]).reshape(-1))
+                n_round = max(n_round, rounds)
+            print(f'personalized pagerank: at most {n_round} push rounds per batch')
+            edge_weight = csr_matrix((np.concatenate(vals).astype(np.float32), (np.concatenate(rows), np.concatenate(cols))),
+                                     shape=(n_users + n_items, n_users + n_items))
+            os.makedirs(precal_path, exist_ok=True)
+            save_npz(file, edge_weight)
+            print(f'Save {os.path.basename(file)} to {precal_path}')
+        end = time.time()
+        print('ppr_edge_mat_sp cost: ', end-start)
+        return edge_weight
+
+
 class SVD():
     def __init__(self, dataset:dataset):
         graph = dataset.Graph #Normalized
@@ -668,15 +873,58 @@ class SVD():
         return adj
     
 
+def share_array(array):
+    '''
+    array that DataLoader workers attach to without a copy: memory-mapped arrays stay mapped (workers reopen the file),
+    others are moved into a torch shared-memory tensor (only a handle is sent to the workers)
+    '''
+    if isinstance(array, np.memmap):
+        return array
+    return torch.from_numpy(np.ascontiguousarray(array)).share_memory_()
+
 class sampler(Dataset):
+    '''
+    Lookup structures are flat arrays in shared memory (see share_array) instead of dicts and lists,
+    so DataLoader workers start without copying them and memory does not grow with num_workers.
+    '''
     def __init__(self, dataset, precal):
         super(sampler, self).__init__()
+        self.refresh(dataset, precal)
+
+    def refresh(self, dataset, precal):
+        '''
+        (re)build the shared state, e.g. after dataset.add_interactions
+        '''
         self.traindataSize = dataset.traindataSize
-        self.trainUser = dataset.trainUser
         self.m_item = dataset.m_item
-        self._allPos = dataset._allPos
-        self.reverse_ItemPopGroupDict = precal.popularity.reverse_ItemPopGroupDict
-        self.ItemPopGroupDict = precal.popularity.ItemPopGroupDict
+        self._shared = {'trainUser': share_array(dataset.trainUser),
+                        'pos_indptr': share_array(dataset.allPos.indptr),
+                        'pos_indices': share_array(dataset.allPos.indices),
+                        'edge_keys': share_array(dataset.edge_lookup.keys),
+                        'edge_order': share_array(dataset.edge_lookup.order),
+                        'item_group': share_array(np.asarray(precal.popularity.item_pop_group_label))}#replaces reverse_ItemPopGroupDict/ItemPopGroupDict
+        self._views = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_views'] = None
+        state['_shared'] = {name: ('memmap', array.filename) if isinstance(array, np.memmap) else array for name, array in self._shared.items()}
+        return state
+
+    def __setstate__(self, state):
+        state['_shared'] = {name: np.load(array[1], mmap_mode='r') if isinstance(array, tuple) else array for name, array in state['_shared'].items()}
+        self.__dict__.update(state)
+
+    def views(self):
+        '''
+        numpy views of the shared arrays, made once per worker
+        '''
+        if self._views is None:
+            views = {name: array.numpy() if torch.is_tensor(array) else array for name, array in self._shared.items()}
+            views['allPos'] = CSRView(views['pos_indptr'], views['pos_indices'])
+            views['edge_lookup'] = EdgeIndex.from_sorted(views['edge_keys'], views['edge_order'], self.m_item)
+            self._views = views
+        return self._views
 
     def __len__(self):
         return self.traindataSize
@@ -687,25 +935,26 @@ class sampler(Dataset):
         output: 随机三元组(user, pos, neg) or (user, pos, pos', neg)
         pos'的popgroup和pos不同
         '''
+        views = self.views()
         if world.config['sampling'] == 'uij':
-            user = self.trainUser[idx]
-            pos = random.choice(self._allPos[user])
+            user = views['trainUser'][idx]
+            pos = random.choice(views['allPos'][user])
             while True:
                 neg = np.random.randint(0, self.m_item)
-                if neg in self._allPos[user]:
+                if views['edge_lookup'].is_edge(user, neg):
                     continue
                 else:
                     break
             return user, pos, neg
         
         elif world.config['sampling'] == 'uii':
-            user = self.trainUser[idx]
-            pos1 = random.choice(self._allPos[user])
-            group1 = self.reverse_ItemPopGroupDict[pos1]
+            user = views['trainUser'][idx]
+            pos1 = random.choice(views['allPos'][user])
+            group1 = views['item_group'][pos1]
             
             for i in range(20):#若20次采样都没有获得不同pop分组的另一个正样本则随机采样pos2
-                pos2 = random.choice(self._allPos[user])
-                if pos2 in self.ItemPopGroupDict[group1]:
+                pos2 = random.choice(views['allPos'][user])
+                if views['item_group'][pos2] == group1:
                     continue
                 else:
                     break
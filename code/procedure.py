@@ -27,7 +27,7 @@ class Train():
     def train(self, sampler, Recmodel, epoch, optimizer, classifier):
         Recmodel:LightGCN = Recmodel
         batch_size = world.config['batch_size']
-        dataloader = DataLoader(sampler, batch_size=batch_size, shuffle=True, drop_last=True, num_workers=4)#每个batch为batch_size对(user, pos_item, neg_item), 见Dataset.__getitem__
+        dataloader = DataLoader(sampler, batch_size=batch_size, shuffle=True, drop_last=True, num_workers=world.config['num_workers'])#每个batch为batch_size对(user, pos_item, neg_item), 见Dataset.__getitem__
 
         total_batch = len(dataloader)
         aver_loss = 0.
@@ -35,14 +35,14 @@ class Train():
 
         for batch_i, train_data in tqdm(enumerate(dataloader), desc='training'):
             if world.config['sampling'] == 'uij':
-                batch_users = train_data[0].long().to(world.device)
-                batch_pos1 = train_data[1].long().to(world.device)
+                batch_users = train_data[0].to(world.device).long()
+                batch_pos1 = train_data[1].to(world.device).long()
                 batch_pos2 = None
-                batch_neg = train_data[2].long().to(world.device)
+                batch_neg = train_data[2].to(world.device).long()
             elif world.config['sampling'] == 'uii':
-                batch_users = train_data[0].long().to(world.device)
-                batch_pos1 = train_data[1].long().to(world.device)
-                batch_pos2 = train_data[2].long().to(world.device)
+                batch_users = train_data[0].to(world.device).long()
+                batch_pos1 = train_data[1].to(world.device).long()
+                batch_pos2 = train_data[2].to(world.device).long()
             else:
                 pass
             if world.config['projector'] == 'w':
@@ -193,8 +193,9 @@ class Test():
         sorted_items = X[0].numpy()
         groundTrue = X[1]
         #================Pop=================#
-        groundTrue_popDict = X[2]#{0: [ [items of u1], [items of u2] ] }
-        r, r_popDict = utils.getLabel(groundTrue, groundTrue_popDict, sorted_items)
+        group_count = X[2]#(batch, num_group) test items of every user in every group
+        r_group = X[3]#(batch, max_K) popularity group of the predicted items
+        r = utils.getLabel(groundTrue, sorted_items)
         #================Pop=================#
         pre, recall, recall_pop, recall_pop_Contribute, ndcg = [], [], {}, {}, []
         num_group = world.config['pop_group']
@@ -204,7 +205,7 @@ class Test():
                 recall_pop_Contribute[group] = []
 
         for k in world.config['topks']:
-            ret = utils.RecallPrecision_ATk(groundTrue, groundTrue_popDict, r, r_popDict, k)
+            ret = utils.RecallPrecision_ATk(groundTrue, group_count, r, r_group, k)
             pre.append(ret['precision'])
             recall.append(ret['recall'])
 
@@ -232,7 +233,8 @@ class Test():
     def test(self, dataset, Recmodel, precal, epoch, multicore=0):
         u_batch_size = world.config['test_u_batch_size']
         testDict: dict = dataset.testDict
-        testDict_pop = precal.popularity.testDict_PopGroup
+        test_group_count = precal.popularity.test_group_count
+        item_group = np.asarray(precal.popularity.item_pop_group_label)
         Recmodel = Recmodel.eval()
         max_K = max(world.config['topks'])
         CORES = multiprocessing.cpu_count() // 2
@@ -258,28 +260,19 @@ class Test():
             users_list = []
             rating_list = []
             groundTrue_list = []
-            groundTrue_list_pop = []
+            group_count_list = []
+            rating_group_list = []
             # auc_record = []
             # ratings = []
             total_batch = len(users) // u_batch_size + 1
             for batch_users in utils.minibatch(users, batch_size=u_batch_size):
-                allPos = dataset.getUserPosItems(batch_users)
                 groundTrue = [testDict[u] for u in batch_users]
-                #================Pop=================#
-                groundTrue_pop = {}
-                for group, ground in testDict_pop.items():
-                    groundTrue_pop[group] = [ground[u] for u in batch_users]
-                #================Pop=================#
-                batch_users_gpu = torch.Tensor(batch_users).long()
+                batch_users_gpu = torch.as_tensor(np.asarray(batch_users, dtype=np.int32))
                 batch_users_gpu = batch_users_gpu.to(world.device)
 
                 rating = Recmodel.getUsersRating(batch_users_gpu)
                 #rating = rating.cpu()
-                exclude_index = []
-                exclude_items = []
-                for range_i, items in enumerate(allPos):
-                    exclude_index.extend([range_i] * len(items))
-                    exclude_items.extend(items)
+                exclude_index, exclude_items = dataset.getUserPosItemsBatch(batch_users)
                 rating[exclude_index, exclude_items] = -(1<<10)
                 _, rating_K = torch.topk(rating, k=max_K)
                 rating = rating.cpu().numpy()
@@ -294,10 +287,11 @@ class Test():
                 rating_list.append(rating_K.cpu())
                 groundTrue_list.append(groundTrue)
                 #================Pop=================#
-                groundTrue_list_pop.append(groundTrue_pop)
+                group_count_list.append(test_group_count[batch_users].toarray())
+                rating_group_list.append(item_group[rating_K.cpu().numpy()])
                 #================Pop=================#
             assert total_batch == len(users_list)
-            X = zip(rating_list, groundTrue_list, groundTrue_list_pop)
+            X = zip(rating_list, groundTrue_list, group_count_list, rating_group_list)
             if multicore == 1:
                 pre_results = pool.map(self.test_one_batch, X)
             else:
@@ -379,18 +373,13 @@ class Test():
             # ratings = []
             total_batch = len(users) // u_batch_size + 1
             for batch_users in utils.minibatch(users, batch_size=u_batch_size):
-                allPos = dataset.getUserPosItems(batch_users)
                 groundTrue = [validDict[u] for u in batch_users]
-                batch_users_gpu = torch.Tensor(batch_users).long()
+                batch_users_gpu = torch.as_tensor(np.asarray(batch_users, dtype=np.int32))
                 batch_users_gpu = batch_users_gpu.to(world.device)
 
                 rating = Recmodel.getUsersRating(batch_users_gpu)
                 #rating = rating.cpu()
-                exclude_index = []
-                exclude_items = []
-                for range_i, items in enumerate(allPos):
-                    exclude_index.extend([range_i] * len(items))
-                    exclude_items.extend(items)
+                exclude_index, exclude_items = dataset.getUserPosItemsBatch(batch_users)
                 rating[exclude_index, exclude_items] = -(1<<10)
                 _, rating_K = torch.topk(rating, k=max_K)
                 rating = rating.cpu().numpy()
@@ -437,16 +426,11 @@ class Test():
 
         with torch.no_grad():
             users = list(batch_users)
-            allPos = dataset.getUserPosItems(batch_users)
             groundTrue = [validDict[u.item()] for u in batch_users]
             batch_users_gpu = batch_users.to(world.device)
 
             rating = Recmodel.getUsersRating(batch_users_gpu)
-            exclude_index = []
-            exclude_items = []
-            for range_i, items in enumerate(allPos):
-                exclude_index.extend([range_i] * len(items))
-                exclude_items.extend(items)
+            exclude_index, exclude_items = dataset.getUserPosItemsBatch(batch_users)
             rating[exclude_index, exclude_items] = -(1<<10)
             _, rating_K = torch.topk(rating, k=max_K)
             recall = self.valid_one_batch_batch([rating_K.cpu(), groundTrue])
@@ -0,0 +1,50 @@
+"""
+Incremental updates of the precalculation after dataset.add_interactions, run from code/ with python -m pytest
+
+@author: Guanming Chen (emilien_chen@buaa.edu.cn)
+Created on Dec 18, 2022
+"""
+import sys
+import numpy as np
+import pytest
+
+sys.argv = sys.argv[:1]#world parses the command line when imported
+pytest.importorskip('torch_sparse')
+import world
+import dataloader
+import precalcul
+
+
+def write_dataset(path, n_user=300, m_item=200, seed=0):
+    rng = np.random.default_rng(seed)
+    for name, size in [('train.txt', 8), ('test.txt', 2)]:
+        with open(path / name, 'w') as f:
+            for user in range(n_user):
+                items = rng.choice(m_item, size, replace=False)
+                f.write(' '.join(map(str, [user] + items.tolist())) + '\n')
+
+@pytest.fixture(params=[0, 1], ids=['in_memory', 'out_of_core'])
+def precal(tmp_path, monkeypatch, request):
+    write_dataset(tmp_path)
+    config = dict(world.config, compact_ids=0, if_valid=0, out_of_core=request.param, adaptive_method='centroid', augment='No', ppr=0)
+    monkeypatch.setitem(world.config, 'centroid_mode', 'degree')
+    monkeypatch.setattr(world, 'PRECALPATH', str(tmp_path / 'precal'))
+    data = dataloader.dataset(config, str(tmp_path))
+    return data, precalcul.precalculate(config, data)
+
+def test_add_interactions_twice(precal):
+    data, pre = precal
+    #a new user: test_group_count gets too small and is dropped
+    pre.add_interactions(data, [data.n_users], [0])
+    #no label changes (an edge of the most popular item) before test_group_count is read again
+    hot = int(np.argmax(data.item_degree))
+    user = next(u for u in range(data.n_users) if hot not in data.allPos[u])
+    pre.add_interactions(data, [user], [hot])
+
+    count = pre.popularity.test_group_count
+    assert count.shape == (data.n_users, pre.popularity.num_group)
+    assert count.sum() == data.testDataSize
+    assert len(pre.popularity.item_pop_group_label) == data.m_items
+    assert pre.popularity.item_pop_sum == data.item_degree.sum() + (data.item_degree == 0).sum()
+    assert data.edge_lookup.lookup([user], [hot])[0] == data.trainDataSize - 1
+    assert hot in data.allPos[user] and user in data.allPos_item[hot]
@@ -86,31 +86,30 @@ def shuffle(*arrays, **kwargs):
 
 # ====================Metrics==============================
 # =========================================================
-def RecallPrecision_ATk(groundTrues, groundTrues_popDict, r, r_popDict, k):
+def RecallPrecision_ATk(groundTrues, group_count, r, r_group, k):
     """
     test_data should be a list? cause users may have different amount of pos items. shape (test_batch, k)
     pred_data : shape (test_batch, k) NOTE: pred_data should be pre-sorted
+    group_count : shape (test_batch, num_group), number of test items of every user in every popularity group
+    r_group : shape (test_batch, k), popularity group of the predicted items
     k : top-k
     """
     right_pred = r[:, :k].sum(1)
-    right_pred_popDict = {}
     num_group = world.config['pop_group']
-    for group in range(num_group):
-        right_pred_popDict[group] = r_popDict[group][:, :k].sum(1)
+    #hits of every user in every group: a hit counts for the group of the predicted item
+    rows = np.repeat(np.arange(len(r)), k).reshape(len(r), k)
+    hit = r[:, :k] > 0
+    right_pred_group = np.bincount(rows[hit] * num_group + r_group[:, :k][hit], minlength=len(r) * num_group).reshape(len(r), num_group)
 
     precis_n = k
     recall_n = np.array([len(groundTrues[i]) for i in range(len(groundTrues))])
 
-    recall_n_popDict = {}
-    for group in range(num_group):
-        recall_n_popDict[group] = np.array([len(groundTrues_popDict[group][i]) for i in range(len(groundTrues_popDict[group]))])
-
     recall = np.sum(right_pred/recall_n)
-    recall_popDict = {}
-    recall_Contribute_popDict = {}
-    for group in range(num_group):
-        recall_popDict[group] = np.sum(right_pred_popDict[group]/recall_n_popDict[group])
-        recall_Contribute_popDict[group] = np.sum(right_pred_popDict[group]/recall_n)
+    #a user without test items in a group adds 0 to the recall of that group
+    recall_group = np.divide(right_pred_group, group_count, out=np.zeros(right_pred_group.shape), where=group_count > 0).sum(0)
+    recall_Contribute_group = (right_pred_group / recall_n[:, None]).sum(0)
+    recall_popDict = dict(enumerate(recall_group))
+    recall_Contribute_popDict = dict(enumerate(recall_Contribute_group))
 
     precis = np.sum(right_pred)/precis_n
 
@@ -175,31 +174,15 @@ def NDCGatK_r(test_data,r,k):
 #     return roc_auc_score(r, test_item_scores)
 
 
-def getLabel(groundTrues, groundTrue_popDicts, pred_data):
+def getLabel(test_data, pred_data):
     r = []
-    #================Pop=================#
-    r_pop = {}
-    for group in range(world.config['pop_group']):
-        r_pop[group] = []
-
-    for user in range(len(groundTrues)):
-        groundTrue = groundTrues[user]
-        groundTrue_popDict = {}
-        for group in range(world.config['pop_group']):
-            groundTrue_popDict[group] = groundTrue_popDicts[group][user]
-        predictTopK = pred_data[user]
+    for i in range(len(test_data)):
+        groundTrue = test_data[i]
+        predictTopK = pred_data[i]
         pred = list(map(lambda x: x in groundTrue, predictTopK))
         pred = np.array(pred).astype("float")
         r.append(pred)
-        pred_pop = {}
-        for group in range(world.config['pop_group']):
-            pred_pop[group] = list(map(lambda x: x in groundTrue_popDict[group], predictTopK))
-            pred_pop[group] = np.array(pred_pop[group]).astype("float")
-            r_pop[group].append(pred_pop[group])
-    for group in range(world.config['pop_group']):
-        r_pop[group] = np.array(r_pop[group]).astype("float")
-    #================Pop=================#
-    return np.array(r).astype('float'), r_pop
+    return np.array(r).astype('float')
 
 def getLabel_Valid(valid_data, pred_data):
     r = []
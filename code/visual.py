@@ -245,7 +245,7 @@ class Quantify():
             filename = os.path.join(filename, title)
             if not os.path.exists(filename):
                 os.makedirs(filename, exist_ok=True)
-            plt.savefig(os.path.join(filename, str(target_user)+'---'+str(epoch)+'.jpg'))
+            plt.savefig(os.path.join(filename, str(self.dataset.to_raw_users(target_user))+'---'+str(epoch)+'.jpg'))
             #plt.show()
             plt.close()
 
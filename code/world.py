@@ -49,7 +49,13 @@ config['loss'] = args.loss
 config['augment'] = args.augment
 config['centroid_mode'] = args.centroid_mode
 config['commonNeighbor_mode'] = args.commonNeighbor_mode
+config['graph_backend'] = args.graph_backend
+config['out_of_core'] = args.out_of_core
+config['compact_ids'] = args.compact_ids
+config['num_workers'] = args.num_workers
 config['adaptive_method'] = args.adaptive_method
+config['ppr'] = args.ppr
+config['ppr_eps'] = args.ppr_eps
 config['if_visual'] = args.if_visual
 config['if_valid'] = args.if_valid
 config['sampling'] = args.sampling